@@ -1,6 +1,7 @@
 import numpy as np
-import arviz as az
-import pandas as pd
+from multiprocessing import Pool
+
+from sketch_utils import KLLSketch
 
 
 def cauchy(x, alpha, beta):
@@ -102,14 +103,157 @@ def mean_mle_analysis(seed):
     return x, x_true, y_true, mean, mode, bins_number
 
 
+def _convergence_checkpoints(n_total, checkpoints, n_min=100):
+    """
+    Log-spaced sample sizes from `n_min` to `n_total`.
+    """
+    return np.unique(np.geomspace(n_min, n_total, checkpoints).astype(np.int64))
+
+
+def _streaming_worker(args):
+    """
+    Stream Cauchy samples and snapshot the running sum and sketch at each
+    checkpoint. Runs in a worker process for `parallel_mean_median`.
+    """
+    seed, n_total, checkpoints, chunk_size, k = args
+    rng = np.random.default_rng(seed)
+    sketch = KLLSketch(k, seed=rng.integers(2**63))
+
+    total, n = 0.0, 0
+    snapshots = []
+    for checkpoint in checkpoints:
+        # Generate up to the next checkpoint in chunks of at most chunk_size
+        while n < checkpoint:
+            size = int(min(chunk_size, checkpoint - n))
+            theta = rng.uniform(-np.pi / 2, np.pi / 2, size)
+            x = trigonometric(theta, 0, 1)
+            total += np.sum(x)
+            sketch.update(x)
+            n += size
+        snapshots.append((n, total, sketch.copy()))
+
+    return snapshots
+
+
+def streaming_mean_median(
+    seed,
+    n_total,
+    checkpoints=30,
+    chunk_size=10**6,
+    quantiles=(0.25, 0.5, 0.75),
+    k=20000,
+):
+    """
+    Study the convergence of the sample mean and median of Cauchy samples
+    as the sample size grows, without holding the samples in memory.
+
+    Samples from `trigonometric` (alpha = 0, beta = 1) are generated in chunks.
+    The running mean is updated exactly and the quantiles are tracked with a
+    mergeable KLL sketch, recorded at log-spaced checkpoints.
+
+    Parameters
+    ----------
+    seed : int
+        The random seed for reproducibility.
+    n_total : int
+        Total number of samples, e.g. 10**9.
+    checkpoints : int, optional
+        Number of log-spaced checkpoints. Default is 30.
+    chunk_size : int, optional
+        Number of samples generated at a time. Default is 10**6.
+    quantiles : tuple of float, optional
+        Quantiles to record. Default is the quartiles.
+    k : int, optional
+        Sketch accuracy parameter. Its rank error should stay below the
+        sampling error of the median, roughly 1 / sqrt(n_total).
+        Default is 20000.
+
+    Returns
+    -------
+    results : dict
+        'n' (checkpoint sample sizes), 'mean' (running mean), 'quantiles'
+        (array of shape (checkpoints, len(quantiles))), 'levels' (the
+        requested quantiles) and 'median' (the 0.5 quantile, if requested).
+    """
+    return parallel_mean_median(seed, n_total, 1, checkpoints, chunk_size, quantiles, k)
+
+
+def parallel_mean_median(
+    seed,
+    n_total,
+    processes,
+    checkpoints=30,
+    chunk_size=10**6,
+    quantiles=(0.25, 0.5, 0.75),
+    k=20000,
+):
+    """
+    Run `streaming_mean_median` split across worker processes.
+
+    Each process streams an independent share of the samples with its own
+    seed. At every checkpoint the running sums are added and the sketches
+    merged, so the combined curve is that of a single stream of the same
+    total size.
+
+    Parameters
+    ----------
+    seed : int
+        The random seed for reproducibility.
+    n_total : int
+        Total number of samples across all processes.
+    processes : int
+        Number of worker processes.
+    checkpoints, chunk_size, quantiles, k
+        See `streaming_mean_median`.
+
+    Returns
+    -------
+    results : dict
+        See `streaming_mean_median`.
+    """
+    per_process = _convergence_checkpoints(
+        int(np.ceil(n_total / processes)), checkpoints
+    )
+    seeds = np.random.SeedSequence(seed).spawn(processes)
+    jobs = [(s, per_process[-1], per_process, chunk_size, k) for s in seeds]
+
+    if processes == 1:
+        results = [_streaming_worker(jobs[0])]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_streaming_worker, jobs)
+
+    n, mean, estimates = [], [], []
+    for snapshots in zip(*results):
+        count = sum(snapshot[0] for snapshot in snapshots)
+        total = sum(snapshot[1] for snapshot in snapshots)
+        sketch = snapshots[0][2]
+        for snapshot in snapshots[1:]:
+            sketch.merge(snapshot[2])
+        n.append(count)
+        mean.append(total / count)
+        estimates.append(sketch.quantile(quantiles))
+
+    results = {
+        "n": np.array(n),
+        "mean": np.array(mean),
+        "quantiles": np.array(estimates),
+        "levels": np.asarray(quantiles),
+    }
+    if 0.5 in quantiles:
+        results["median"] = results["quantiles"][:, list(quantiles).index(0.5)]
+    return results
+
+
 def thinning(trace):
     """
     Apply thinning to the provided trace to reduce autocorrelation.
 
     This function calculates the effective sample size (ESS) for all variables
     in the trace, determines the minimum ESS and computes the thinning interval
-    based on the autocorrelation time (tau). It then thins the trace accordingly
-    and returns the thinned trace as an InferenceData object.
+    based on the autocorrelation time (tau). It then thins the trace (and its
+    sampler statistics, if present) accordingly and returns the thinned trace
+    as an InferenceData object.
 
     Parameters
     ----------
@@ -122,8 +266,10 @@ def thinning(trace):
         The thinned trace, encapsulated in an ArviZ InferenceData object.
 
     """
-    # Compute ESS for all variables
-    ess_results = az.ess(trace)
+    import arviz as az
+
+    # Compute ESS for all variables, accumulating in double precision
+    ess_results = az.ess(trace.posterior.astype(np.float64))
 
     # Find the minimum ESS across all variables
     min_ess = ess_results.to_array().min().values.item()
@@ -144,8 +290,14 @@ def thinning(trace):
     # Thin the trace by slicing with the thinning interval using xarray's isel method
     thinned_posterior = trace.posterior.isel(draw=slice(None, None, thinning_interval))
 
-    # Create a new InferenceData object with the thinned posterior
-    thinned_trace = az.InferenceData(posterior=thinned_posterior)
+    # Create a new InferenceData object with the thinned posterior, keeping the
+    # matching sampler statistics if there are any
+    groups = {"posterior": thinned_posterior}
+    if "sample_stats" in trace.groups():
+        groups["sample_stats"] = trace.sample_stats.isel(
+            draw=slice(None, None, thinning_interval)
+        )
+    thinned_trace = az.InferenceData(**groups)
 
     # Thinned trace
     num_chains = len(thinned_trace.posterior.chain)
@@ -188,14 +340,18 @@ def convergence_diagnostic(thinned_trace):
     -----
     The function prints the DataFrame as a table for quick inspection.
     """
+    import arviz as az
+    import pandas as pd
 
     # Thinned trace details
     num_chains = len(thinned_trace.posterior.chain)
     num_samples_per_chain = len(thinned_trace.posterior.draw)
     total_samples_thinned = num_chains * num_samples_per_chain
 
-    # Compute the mean and standard deviation for each parameter
-    summary_stats = az.summary(thinned_trace, round_to=2)
+    # Compute the mean and standard deviation for each parameter, accumulating
+    # in double precision in case the trace is stored as float32
+    posterior = thinned_trace.posterior.astype(np.float64)
+    summary_stats = az.summary(posterior, round_to=2)
 
     # Create a DataFrame to hold the results
     diagnostic_df = pd.DataFrame(
@@ -212,6 +368,8 @@ def convergence_diagnostic(thinned_trace):
     # Print the DataFrame as a table
     print(diagnostic_df)
 
+    return diagnostic_df
+
 
 def appendix_data(trace):
     """
@@ -230,5 +388,163 @@ def appendix_data(trace):
     -----
     The summary is printed directly to the console.
     """
+    import arviz as az
+
     # Print summary statistics of the trace
     print(az.summary(trace, round_to=2))
+
+
+def _spectral_variance_of_mean(segments, mask):
+    """
+    Estimate the variance of the mean of masked segments from the spectral
+    density at frequency zero.
+
+    The spectral density at zero is the sum of the autocovariances, truncated
+    with Geyer's initial positive sequence: autocovariances are summed in
+    adjacent pairs up to the first pair with a non-positive sum.
+
+    Parameters
+    ----------
+    segments : ndarray
+        Array of shape (..., length) holding the segments, padded to a common
+        length.
+    mask : ndarray
+        Boolean array of shape (intervals, length) marking the valid draws,
+        broadcast against `segments`.
+
+    Returns
+    -------
+    mean : ndarray
+        Mean of each segment.
+    variance : ndarray
+        Spectral estimate of the variance of each segment mean.
+    """
+    n = mask.sum(axis=-1)
+    mean = np.sum(segments * mask, axis=-1) / n
+    centred = np.where(mask, segments - mean[..., None], 0.0)
+
+    # Autocovariances of every segment at once via zero padded FFTs
+    length = segments.shape[-1]
+    nfft = 1 << int(2 * length - 1).bit_length()
+    spectrum = np.fft.rfft(centred, n=nfft, axis=-1)
+    acov = np.fft.irfft(np.abs(spectrum) ** 2, n=nfft, axis=-1)[..., : length + 1]
+    acov = acov[..., : 2 * (acov.shape[-1] // 2)] / n[:, None]
+
+    # Initial positive sequence, keeping the pairs before the first non-positive
+    pairs = acov[..., 0::2] + acov[..., 1::2]
+    positive = np.cumprod(pairs > 0, axis=-1)
+    spectral_density = -acov[..., 0] + 2 * np.sum(pairs * positive, axis=-1)
+
+    return mean, np.maximum(spectral_density, acov[..., 0]) / n
+
+
+def geweke_scores(samples, first=0.1, last=0.5, intervals=20):
+    """
+    Compute Geweke z-scores for every series and interval in one pass.
+
+    Following `arviz.geweke`, the start of the chain is moved through
+    `intervals` points in its first half; for each start the mean of the first
+    `first` fraction of the remaining draws is compared with the mean of the
+    last `last` fraction. The variance of each mean is estimated from the
+    spectral density at zero, so autocorrelation within the segments is taken
+    into account.
+
+    Parameters
+    ----------
+    samples : ndarray
+        Array of shape (..., draws), e.g. (variables, chains, draws).
+    first : float, optional
+        Fraction of the draws in the first segment. Default is 0.1.
+    last : float, optional
+        Fraction of the draws in the last segment. Default is 0.5.
+    intervals : int, optional
+        Number of start points. Default is 20.
+
+    Returns
+    -------
+    starts : ndarray
+        Start iteration of each interval.
+    z_scores : ndarray
+        Geweke z-scores of shape (..., intervals).
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    end = samples.shape[-1] - 1
+    starts = np.linspace(0, end // 2, intervals, endpoint=False).astype(int)
+    remaining = end - starts
+
+    # Segments as in arviz.geweke, the last one running up to the final draw
+    first_length = (first * remaining).astype(int)
+    first_start = starts
+    last_start = (end - last * remaining).astype(int)
+    last_length = end + 1 - last_start
+
+    z_scores = []
+    means_and_variances = []
+    for start, length in ((first_start, first_length), (last_start, last_length)):
+        offsets = np.arange(length.max())
+        index = np.minimum(start[:, None] + offsets, end)
+        mask = offsets < length[:, None]
+        segments = samples[..., index]
+        means_and_variances.append(_spectral_variance_of_mean(segments, mask))
+
+    (mean_first, var_first), (mean_last, var_last) = means_and_variances
+    z_scores = (mean_first - mean_last) / np.sqrt(var_first + var_last)
+
+    return starts, z_scores
+
+
+def geweke_trace(trace, first=0.1, last=0.5, intervals=20):
+    """
+    Compute Geweke z-scores for every variable, chain and interval of a trace.
+
+    Parameters
+    ----------
+    trace : arviz.InferenceData
+        The MCMC trace, encapsulated in an ArviZ InferenceData object.
+    first, last, intervals
+        See `geweke_scores`.
+
+    Returns
+    -------
+    var_names : list of str
+        Name of each scalar variable. Vector variables are expanded as
+        'name[i]'.
+    starts : ndarray
+        Start iteration of each interval.
+    z_scores : ndarray
+        Geweke z-scores of shape (variables, chains, intervals).
+    """
+    var_names, stacked = [], []
+    for var_name, values in trace.posterior.data_vars.items():
+        values = values.values.reshape(values.shape[0], values.shape[1], -1)
+        if values.shape[-1] == 1:
+            var_names.append(var_name)
+        else:
+            var_names.extend(f"{var_name}[{i}]" for i in range(values.shape[-1]))
+        stacked.append(np.moveaxis(values, -1, 0))
+
+    starts, z_scores = geweke_scores(np.concatenate(stacked), first, last, intervals)
+    return var_names, starts, z_scores
+
+
+def geweke_gate(z_scores, threshold=2, max_fraction=0.25):
+    """
+    Pass or fail each variable and chain on its Geweke z-scores.
+
+    Parameters
+    ----------
+    z_scores : ndarray
+        Array of shape (..., intervals) from `geweke_scores` or `geweke_trace`.
+    threshold : float, optional
+        Absolute z-score above which an interval counts as failing.
+        Default is 2.
+    max_fraction : float, optional
+        Largest fraction of failing intervals allowed. Neighbouring intervals
+        share draws, so their z-scores are correlated. Default is 0.25.
+
+    Returns
+    -------
+    passed : ndarray
+        Boolean array of shape z_scores.shape[:-1].
+    """
+    return np.mean(np.abs(z_scores) > threshold, axis=-1) <= max_fraction
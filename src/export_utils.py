@@ -0,0 +1,251 @@
+import os
+import json
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+INDEX_FILE = "index.jsonl"
+
+
+def data_hash(x_observed, I_observed=None):
+    """
+    Hash the observed data so runs can be matched to the data they used.
+
+    Parameters:
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray, optional
+        Observed intensities.
+
+    Returns:
+    - str
+        SHA-256 hex digest of the float64 data.
+    """
+    digest = hashlib.sha256(np.asarray(x_observed, dtype=np.float64).tobytes())
+    if I_observed is not None:
+        digest.update(np.asarray(I_observed, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def tag_run(trace, config, seed, data_digest):
+    """
+    Record the configuration, seed and data hash of a run in its trace.
+
+    The values are stored as posterior attributes, so they are saved with the
+    trace and `export_run` can later index it without guessing them.
+
+    Parameters:
+    - trace : arviz.InferenceData
+        The trace of the run.
+    - config : dict
+        Run configuration, e.g. model and sampling parameters.
+    - seed : int
+        The random seed of the run.
+    - data_digest : str
+        Hash of the observed data, see `data_hash`.
+
+    Returns:
+    - trace : arviz.InferenceData
+        The same trace, for chaining.
+    """
+    trace.posterior.attrs["config"] = json.dumps(config)
+    trace.posterior.attrs["seed"] = int(seed)
+    trace.posterior.attrs["data_hash"] = data_digest
+    return trace
+
+
+def run_metadata(trace):
+    """
+    Return the configuration, seed and data hash recorded by `tag_run`.
+
+    Parameters:
+    - trace : arviz.InferenceData
+        A trace, e.g. read with `arviz.from_netcdf`.
+
+    Returns:
+    - tuple or None
+        (config, seed, data_digest), or None if the trace was not tagged.
+    """
+    attrs = trace.posterior.attrs
+    if not all(key in attrs for key in ("config", "seed", "data_hash")):
+        return None
+    return json.loads(attrs["config"]), int(attrs["seed"]), str(attrs["data_hash"])
+
+
+def _encoding(dataset, chunk_draws, significant_digits):
+    """
+    Per-variable compression settings for a dataset with (chain, draw, ...)
+    variables.
+
+    Floating point columns use zlib with byte shuffling, which groups the
+    slowly varying exponent bytes together, and optionally keep only
+    `significant_digits` decimal digits. Integer and boolean columns use zlib
+    alone. Chunks span one chain and `chunk_draws` draws, so reading one
+    variable, chain or draw range only decompresses the chunks it touches.
+    """
+    encoding = {}
+    for name, variable in dataset.data_vars.items():
+        settings = {"zlib": True, "complevel": 4}
+        if variable.dims[:2] == ("chain", "draw"):
+            chunks = [1, min(chunk_draws, variable.shape[1])]
+            settings["chunksizes"] = tuple(chunks + list(variable.shape[2:]))
+        if variable.dtype.kind == "f":
+            settings["shuffle"] = True
+            if significant_digits is not None:
+                settings["least_significant_digit"] = significant_digits
+        encoding[name] = settings
+    return encoding
+
+
+def export_run(
+    path,
+    trace,
+    diagnostics=None,
+    config=None,
+    seed=None,
+    data_digest=None,
+    chunk_draws=1024,
+    significant_digits=None,
+):
+    """
+    Write a trace, its sampler statistics and diagnostics to a compressed,
+    chunked netCDF4 file and record it in the archive index.
+
+    The posterior and sample_stats groups are stored column by column with
+    per-variable codecs (see `_encoding`), and the diagnostics table in its own
+    group. The config, seed and data hash are stored as file attributes and
+    appended, with the file name and shape of the trace, to 'index.jsonl' in
+    the same directory.
+
+    Parameters:
+    - path : str
+        Output file, e.g. 'runs/run_0001.nc'.
+    - trace : arviz.InferenceData
+        The (typically thinned) trace to export.
+    - diagnostics : pandas.DataFrame, optional
+        Diagnostics table, e.g. from `convergence_diagnostic`.
+    - config : dict, optional
+        Run configuration, e.g. model and sampling parameters.
+    - seed : int, optional
+        The random seed of the run.
+    - data_digest : str, optional
+        Hash of the observed data, see `data_hash`.
+    - chunk_draws : int, optional
+        Number of draws per chunk. Default is 1024.
+    - significant_digits : int, optional
+        If set, floats are quantised to this many decimal digits before
+        compression. Default is lossless.
+
+    Returns:
+    - metadata : dict
+        The index entry written for this run.
+    """
+    metadata = {
+        "file": os.path.basename(path),
+        "created": datetime.datetime.now().isoformat(),
+        "config": config or {},
+        "seed": seed,
+        "data_hash": data_digest,
+        "variables": list(trace.posterior.data_vars),
+        "chains": int(trace.posterior.sizes["chain"]),
+        "draws": int(trace.posterior.sizes["draw"]),
+    }
+    attrs = {
+        "config": json.dumps(metadata["config"]),
+        "seed": -1 if seed is None else int(seed),
+        "data_hash": data_digest or "",
+    }
+
+    groups = [("posterior", trace.posterior)]
+    if "sample_stats" in trace.groups():
+        groups.append(("sample_stats", trace.sample_stats))
+    if diagnostics is not None:
+        table = diagnostics.rename_axis("variable").astype(np.float64)
+        groups.append(("diagnostics", xr.Dataset.from_dataframe(table)))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    mode = "w"
+    for group, dataset in groups:
+        dataset = dataset.copy()
+        dataset.attrs = dict(attrs) if group == "posterior" else {}
+        dataset.to_netcdf(
+            path,
+            mode=mode,
+            group=group,
+            engine="netcdf4",
+            encoding=_encoding(dataset, chunk_draws, significant_digits),
+        )
+        mode = "a"
+
+    with open(os.path.join(directory, INDEX_FILE), "a") as file:
+        file.write(json.dumps(metadata) + "\n")
+
+    return metadata
+
+
+def read_variable(path, var_name, chain=None, draws=None, group="posterior"):
+    """
+    Read one variable from an exported run, decompressing only what is needed.
+
+    Parameters:
+    - path : str
+        File written by `export_run`.
+    - var_name : str
+        Name of the variable, e.g. 'alpha' or 'diverging'.
+    - chain : int or slice, optional
+        Chain(s) to read. Defaults to all chains.
+    - draws : slice, optional
+        Range of draws to read. Defaults to all draws.
+    - group : str, optional
+        Group of the variable, 'posterior' or 'sample_stats'.
+        Default is 'posterior'.
+
+    Returns:
+    - numpy.ndarray
+        The selected values.
+    """
+    selection = {}
+    if chain is not None:
+        selection["chain"] = chain
+    if draws is not None:
+        selection["draw"] = draws
+
+    with xr.open_dataset(path, group=group, engine="netcdf4") as dataset:
+        return dataset[var_name].isel(selection).values
+
+
+def read_diagnostics(path):
+    """
+    Read the diagnostics table of an exported run.
+
+    Parameters:
+    - path : str
+        File written by `export_run`.
+
+    Returns:
+    - pandas.DataFrame
+        The diagnostics table indexed by variable.
+    """
+    with xr.open_dataset(path, group="diagnostics", engine="netcdf4") as dataset:
+        return dataset.to_dataframe()
+
+
+def read_index(directory):
+    """
+    Read the archive index of a directory of exported runs.
+
+    Parameters:
+    - directory : str
+        Directory containing 'index.jsonl'.
+
+    Returns:
+    - pandas.DataFrame
+        One row per exported run, with the config expanded into columns.
+    """
+    with open(os.path.join(directory, INDEX_FILE)) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    return pd.json_normalize(entries)
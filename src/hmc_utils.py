@@ -0,0 +1,338 @@
+import numpy as np
+import arviz as az
+from scipy.special import logsumexp
+
+from likelihood_utils import (
+    from_unconstrained,
+    to_unconstrained,
+    log_posterior_and_grad,
+)
+
+
+def _leapfrog(q, p, grad, step_size, inv_mass, logp_and_grad):
+    """
+    One leapfrog step for every chain, with per-chain step sizes.
+    """
+    p = p + 0.5 * step_size[:, None] * grad
+    q = q + step_size[:, None] * inv_mass * p
+    logp, grad = logp_and_grad(q)
+    p = p + 0.5 * step_size[:, None] * grad
+    return q, p, logp, grad
+
+
+def _no_u_turn(p_left, p_right, rho, inv_mass):
+    """
+    Generalised no-U-turn criterion, True where the trajectory may continue.
+    """
+    return (np.sum(inv_mass * p_left * rho, axis=-1) > 0) & (
+        np.sum(inv_mass * p_right * rho, axis=-1) > 0
+    )
+
+
+def _subtree_no_u_turn(p, inv_mass):
+    """
+    Check the U-turn criterion on every balanced sub-block of new subtrees.
+
+    Parameters:
+    - p : numpy.ndarray
+        Momenta of the new states, shape (2**depth, chains, dim), in the order
+        they were integrated.
+    - inv_mass : numpy.ndarray
+        Diagonal inverse mass matrix of shape (chains, dim).
+
+    Returns:
+    - numpy.ndarray
+        Boolean of shape (chains,), False if any sub-block made a U-turn.
+    """
+    n_steps, n_chains, dim = p.shape
+    valid = np.ones(n_chains, dtype=bool)
+    size = 2
+    while size <= n_steps:
+        blocks = p.reshape(n_steps // size, size, n_chains, dim)
+        rho = blocks.sum(axis=1)
+        ok = _no_u_turn(blocks[:, 0], blocks[:, -1], rho, inv_mass)
+        valid &= ok.all(axis=0)
+        size *= 2
+    return valid
+
+
+def nuts_step(q, logp, grad, step_size, inv_mass, logp_and_grad, rng, max_depth):
+    """
+    Advance every chain by one multinomial NUTS transition in lockstep.
+
+    All chains double their trajectories together and every leapfrog step is
+    a single vectorised log-density and gradient call. Chains whose tree has
+    terminated (U-turn, divergence or maximum depth) are masked and keep
+    their state while the others continue.
+
+    Parameters:
+    - q : numpy.ndarray
+        Current positions, shape (chains, dim).
+    - logp, grad : numpy.ndarray
+        Log density and gradient at q.
+    - step_size : numpy.ndarray
+        Step size per chain.
+    - inv_mass : numpy.ndarray
+        Diagonal inverse mass matrix per chain, shape (chains, dim).
+    - logp_and_grad : callable
+        Function returning the log density and gradient of a (chains, dim)
+        array.
+    - rng : numpy.random.Generator
+        Random number generator.
+    - max_depth : int
+        Maximum tree depth.
+
+    Returns:
+    - q, logp, grad : numpy.ndarray
+        The new positions with their log density and gradient.
+    - stats : dict
+        Per-chain 'tree_depth', 'diverging', 'acceptance_rate', 'energy'
+        and 'n_steps'.
+    """
+    n_chains, dim = q.shape
+    p0 = rng.standard_normal((n_chains, dim)) / np.sqrt(inv_mass)
+    energy0 = -logp + 0.5 * np.sum(inv_mass * p0**2, axis=-1)
+
+    # Trajectory edges, proposal and running totals per chain
+    left = [q, p0, grad]
+    right = [q, p0, grad]
+    proposal = [q, logp, grad]
+    log_weight = -energy0
+    rho = p0.copy()
+
+    active = np.ones(n_chains, dtype=bool)
+    depth = np.zeros(n_chains, dtype=int)
+    diverging = np.zeros(n_chains, dtype=bool)
+    accept_sum = np.zeros(n_chains)
+    n_steps = np.zeros(n_chains, dtype=int)
+
+    for j in range(max_depth):
+        if not active.any():
+            break
+
+        direction = np.where(rng.random(n_chains) < 0.5, -1.0, 1.0)
+        forward = direction > 0
+        q_edge = np.where(forward[:, None], right[0], left[0])
+        p_edge = np.where(forward[:, None], right[1], left[1])
+        g_edge = np.where(forward[:, None], right[2], left[2])
+
+        # Integrate the new subtree of 2**j steps for all chains at once
+        steps = 2**j
+        qs = np.empty((steps, n_chains, dim))
+        ps = np.empty((steps, n_chains, dim))
+        gs = np.empty((steps, n_chains, dim))
+        logps = np.empty((steps, n_chains))
+        for i in range(steps):
+            q_edge, p_edge, logp_edge, g_edge = _leapfrog(
+                q_edge, p_edge, g_edge, direction * step_size, inv_mass, logp_and_grad
+            )
+            qs[i], ps[i], gs[i], logps[i] = q_edge, p_edge, g_edge, logp_edge
+
+        with np.errstate(invalid="ignore", over="ignore"):
+            energies = -logps + 0.5 * np.sum(inv_mass * ps**2, axis=-1)
+            energies = np.where(np.isfinite(energies), energies, np.inf)
+            delta = energies - energy0
+            accept_sum += np.where(active, np.minimum(1, np.exp(-delta)).sum(axis=0), 0)
+        n_steps += np.where(active, steps, 0)
+
+        divergent = (delta > 1000).any(axis=0)
+        valid = ~divergent & _subtree_no_u_turn(ps, inv_mass)
+        diverging |= active & divergent
+
+        # Multinomial sample within the subtree via the Gumbel-max trick
+        sub_weights = -energies
+        sub_log_weight = logsumexp(sub_weights, axis=0)
+        pick = np.argmax(sub_weights + rng.gumbel(size=sub_weights.shape), axis=0)
+        chains = np.arange(n_chains)
+
+        # Biased progressive sampling: favour the new subtree
+        accept = np.log(rng.random(n_chains)) < sub_log_weight - log_weight
+        update = active & valid
+        take = update & accept
+        proposal[0] = np.where(take[:, None], qs[pick, chains], proposal[0])
+        proposal[1] = np.where(take, logps[pick, chains], proposal[1])
+        proposal[2] = np.where(take[:, None], gs[pick, chains], proposal[2])
+        log_weight = np.where(
+            update, np.logaddexp(log_weight, sub_log_weight), log_weight
+        )
+
+        # Extend the trajectory edges in the integration direction
+        new_right = update & forward
+        new_left = update & ~forward
+        right = [
+            np.where(new_right[:, None], e[-1], r) for e, r in zip((qs, ps, gs), right)
+        ]
+        left = [
+            np.where(new_left[:, None], e[-1], l) for e, l in zip((qs, ps, gs), left)
+        ]
+        rho = np.where(update[:, None], rho + ps.sum(axis=0), rho)
+        depth = np.where(active, j + 1, depth)
+
+        active = update & _no_u_turn(left[1], right[1], rho, inv_mass)
+
+    stats = {
+        "tree_depth": depth,
+        "diverging": diverging,
+        "acceptance_rate": accept_sum / np.maximum(n_steps, 1),
+        "energy": energy0,
+        "n_steps": n_steps,
+    }
+    return proposal[0], proposal[1], proposal[2], stats
+
+
+def sample_nuts(
+    x_observed,
+    I_observed,
+    seed,
+    draws,
+    tune,
+    chains,
+    target_accept,
+    a,
+    b,
+    c,
+    d,
+    max_depth=10,
+    init_trace=None,
+    precision=None,
+):
+    """
+    Sample the lighthouse posterior with a pure NumPy NUTS, all chains in lockstep.
+
+    The state of every chain is held in one (chains, dim) array and each
+    leapfrog step evaluates the log density and gradient of all chains in a
+    single vectorised call, so hundreds of chains cost little more than one.
+    During tuning the step size of each chain is adapted by dual averaging and
+    a diagonal mass matrix is estimated from the middle half of the tuning
+    draws.
+
+    Parameters:
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities. If None, the `define_model_x` posterior is
+        sampled, otherwise the `define_model_xi` posterior.
+    - seed : int
+        The random seed to use for reproducibility.
+    - draws, tune, chains, target_accept
+        Sampling parameters as in `sample_model`.
+    - a, b, c, d : float
+        Prior bounds for alpha and beta.
+    - max_depth : int, optional
+        Maximum tree depth. Default is 10.
+    - init_trace : arviz.InferenceData, optional
+        A previous trace of the same model, e.g. before new flashes were
+        appended. Chains start from its last draws, with its final step sizes
+        and a mass matrix from its posterior variance, so a short `tune`
+        suffices. Adaptation then continues from these values.
+    - precision : str, optional
+        Floating point precision of the stored posterior and sampler
+        statistics, 'float32' or 'float64'. Sampling itself always runs in
+        float64. Defaults to float64.
+
+    Returns:
+    - trace : arviz.InferenceData
+        Posterior draws of alpha, beta (and I0) with sampler statistics,
+        compatible with `thinning` and the plotting functions.
+    """
+    rng = np.random.default_rng(seed)
+    x_observed = np.asarray(x_observed, dtype=np.float64)
+    if I_observed is not None:
+        I_observed = np.asarray(I_observed, dtype=np.float64)
+    dim = 2 if I_observed is None else 3
+
+    def logp_and_grad(u):
+        return log_posterior_and_grad(u, x_observed, I_observed, a, b, c, d)
+
+    var_names = ["alpha", "beta", "I0"][:dim]
+    if init_trace is None:
+        # Jittered start around the centre of the priors, as in PyMC3's jitter
+        q = rng.uniform(-1, 1, (chains, dim))
+        inv_mass = np.ones((chains, dim))
+        step_size = np.full(chains, 0.25)
+    else:
+        # Warm start from the last draws and adaptation of the previous run
+        previous = np.stack(
+            [init_trace.posterior[name].values for name in var_names], axis=-1
+        )
+        previous = to_unconstrained(previous, a, b, c, d)
+        index = np.arange(chains) % previous.shape[0]
+        q = previous[index, -1]
+        inv_mass = np.tile(np.var(previous, axis=(0, 1)), (chains, 1))
+        step_size = init_trace.sample_stats["step_size"].values[index, -1]
+    logp, grad = logp_and_grad(q)
+
+    # Dual averaging of the step size (Hoffman & Gelman, 2014)
+    mu = np.log(10 * step_size)
+    log_step_bar = np.zeros(chains)
+    h_bar = np.zeros(chains)
+    t = 0
+    # A warm start keeps the pooled mass matrix of the previous run
+    window = (tune // 4, 3 * tune // 4) if init_trace is None else (0, 0)
+    window_draws = []
+
+    samples = np.empty((chains, draws, dim))
+    sample_stats = {
+        key: np.empty((chains, draws), dtype=dtype)
+        for key, dtype in [
+            ("lp", float),
+            ("step_size", float),
+            ("tree_depth", int),
+            ("diverging", bool),
+            ("acceptance_rate", float),
+            ("energy", float),
+            ("n_steps", int),
+        ]
+    }
+
+    for i in range(tune + draws):
+        q, logp, grad, stats = nuts_step(
+            q, logp, grad, step_size, inv_mass, logp_and_grad, rng, max_depth
+        )
+
+        if i < tune:
+            t += 1
+            h_bar += (target_accept - stats["acceptance_rate"] - h_bar) / (t + 10)
+            log_step = mu - np.sqrt(t) / 0.05 * h_bar
+            log_step_bar += t**-0.75 * (log_step - log_step_bar)
+            step_size = np.exp(log_step)
+
+            if window[0] <= i < window[1]:
+                window_draws.append(q)
+            if i == window[1] - 1 and len(window_draws) > 10:
+                # Regularised diagonal mass matrix, then restart the step size
+                n = len(window_draws)
+                variance = np.var(np.array(window_draws), axis=0, ddof=1)
+                inv_mass = (n / (n + 5)) * variance + 1e-3 * (5 / (n + 5))
+                mu = np.log(10 * step_size)
+                log_step_bar[:] = 0
+                h_bar[:] = 0
+                t = 0
+            if i == tune - 1:
+                step_size = np.exp(log_step_bar)
+        else:
+            k = i - tune
+            samples[:, k] = q
+            sample_stats["lp"][:, k] = logp
+            sample_stats["step_size"][:, k] = step_size
+            for key in ("tree_depth", "diverging", "acceptance_rate", "energy"):
+                sample_stats[key][:, k] = stats[key]
+            sample_stats["n_steps"][:, k] = stats["n_steps"]
+
+    params = from_unconstrained(samples, a, b, c, d)
+    posterior = {name: params[..., j] for j, name in enumerate(var_names)}
+    if precision is not None:
+        # Cast floating point values only, leaving flags such as `diverging`
+        posterior = {
+            name: values.astype(precision) for name, values in posterior.items()
+        }
+        sample_stats = {
+            key: values.astype(precision) if values.dtype.kind == "f" else values
+            for key, values in sample_stats.items()
+        }
+
+    print(
+        f"Sampled {chains} chains with {draws} draws, "
+        f"{sample_stats['diverging'].sum()} divergences"
+    )
+    return az.from_dict(posterior=posterior, sample_stats=sample_stats)
@@ -0,0 +1,303 @@
+import numpy as np
+import arviz as az
+from scipy import optimize, stats
+from scipy.special import gammaln, logsumexp
+
+from likelihood_utils import PARETO_M, collapsed_I0_moments, log_posterior
+
+
+def _to_params(z):
+    """
+    Map proposal-space points (alpha, beta[, log I0]) to model parameters.
+    """
+    if z.shape[-1] == 3:
+        return np.concatenate([z[..., :2], np.exp(z[..., 2:])], axis=-1)
+    return z
+
+
+def _log_target(z, x_observed, I_observed, a, b, c, d):
+    """
+    Log posterior in proposal space, including the Jacobian of log I0.
+    """
+    logp = log_posterior(_to_params(z), x_observed, I_observed, a, b, c, d)
+    if z.shape[-1] == 3:
+        logp = logp + z[..., 2]
+    return logp
+
+
+def _support(dim, a, b, c, d):
+    """
+    Lower and upper bounds of the proposal space (alpha, beta[, log I0]).
+    """
+    lower = np.array([a, max(c, 0.0), np.log(PARETO_M)])[:dim]
+    upper = np.array([b, d, np.inf])[:dim]
+    return lower, upper
+
+
+def _numerical_hessian(f, z, step=1e-4, lower=None, upper=None):
+    """
+    Central finite difference Hessian of `f` at `z`, evaluated in one batch.
+
+    If `lower` and `upper` bounds are given, the stencil is centred at the
+    nearest point whose stencil stays inside them, so `f` is never evaluated
+    outside its support.
+    """
+    dim = len(z)
+    h = step * np.maximum(np.abs(z), 1.0)
+    eye = np.eye(dim) * h
+    if lower is not None:
+        z = np.clip(z, lower + 2 * h, upper - 2 * h)
+
+    # Build every perturbed point up front so `f` is called only once
+    points = []
+    for i in range(dim):
+        for j in range(dim):
+            points.extend(
+                [
+                    z + eye[i] + eye[j],
+                    z + eye[i] - eye[j],
+                    z - eye[i] + eye[j],
+                    z - eye[i] - eye[j],
+                ]
+            )
+    values = f(np.array(points)).reshape(dim, dim, 4)
+
+    hessian = (values[..., 0] - values[..., 1] - values[..., 2] + values[..., 3]) / (
+        4 * np.outer(h, h)
+    )
+    return 0.5 * (hessian + hessian.T)
+
+
+def find_mode(x_observed, I_observed, a, b, c, d, collapsed=False):
+    """
+    Find the posterior mode and a Laplace covariance for the lighthouse models.
+
+    The search starts from robust Cauchy estimates of the location (median) and
+    scale (half the interquartile range) of the flash locations.
+
+    Parameters:
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities. If None, only (alpha, beta) are fitted.
+    - a, b, c, d : float
+        Prior bounds for alpha and beta.
+    - collapsed : bool, optional
+        If True, fit only (alpha, beta) with I0 integrated out of the
+        intensity likelihood. Default is False.
+
+    Returns:
+    - mode : numpy.ndarray
+        Posterior mode in proposal space (alpha, beta[, log I0]).
+    - cov : numpy.ndarray
+        Inverse of the negative Hessian at the mode. If the mode lies on a
+        prior boundary or the curvature is not positive definite, a diagonal
+        covariance is used instead, with a variance of (prior width / 4)**2
+        in the directions where the curvature is not usable.
+    """
+    q25, q50, q75 = np.percentile(x_observed, [25, 50, 75])
+    z0 = [np.clip(q50, a, b), np.clip(0.5 * (q75 - q25), c + 1e-3, d)]
+    if I_observed is not None and not collapsed:
+        d2 = z0[1] ** 2 + (x_observed - z0[0]) ** 2
+        z0.append(np.mean(np.log(I_observed) + np.log(d2)))
+    z0 = np.array(z0, dtype=float)
+
+    def f(z):
+        return _log_target(z, x_observed, I_observed, a, b, c, d)
+
+    result = optimize.minimize(lambda z: -f(z), z0, method="Nelder-Mead")
+    mode = result.x
+
+    lower, upper = _support(len(mode), a, b, c, d)
+    h = 1e-4 * np.maximum(np.abs(mode), 1.0)
+    on_boundary = (mode - lower < 2 * h) | (upper - mode < 2 * h)
+    hessian = _numerical_hessian(f, mode, lower=lower, upper=upper)
+
+    try:
+        cov = np.linalg.inv(-hessian)
+        np.linalg.cholesky(cov)
+        valid = np.isfinite(cov).all() and not on_boundary.any()
+    except np.linalg.LinAlgError:
+        valid = False
+
+    if not valid:
+        # Mode on a prior boundary or curvature unusable, fall back to the
+        # diagonal curvature and to the prior scale where that fails too
+        prior_var = (np.array([b - a, d - c, 4.0])[: len(mode)] / 4) ** 2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            var = -1.0 / np.diag(hessian)
+        usable = np.isfinite(var) & (var > 0) & ~on_boundary
+        cov = np.diag(np.where(usable, np.minimum(var, prior_var), prior_var))
+
+    return mode, cov
+
+
+def student_t_sample(mode, cov, df, size, rng):
+    """
+    Draw from a multivariate Student-t distribution.
+
+    Parameters:
+    - mode : numpy.ndarray
+        Location of the distribution.
+    - cov : numpy.ndarray
+        Scale matrix of the distribution.
+    - df : float
+        Degrees of freedom.
+    - size : int
+        Number of draws.
+    - rng : numpy.random.Generator
+        Random number generator.
+
+    Returns:
+    - numpy.ndarray
+        Draws of shape (size, len(mode)).
+    """
+    chol = np.linalg.cholesky(cov)
+    normal = rng.standard_normal((size, len(mode)))
+    scale = np.sqrt(df / rng.chisquare(df, size))
+    return mode + scale[:, None] * normal @ chol.T
+
+
+def student_t_logpdf(z, mode, cov, df):
+    """
+    Log density of a multivariate Student-t distribution.
+
+    Parameters:
+    - z : numpy.ndarray
+        Points of shape (n, dim).
+    - mode, cov, df
+        Parameters of the distribution, see `student_t_sample`.
+
+    Returns:
+    - numpy.ndarray
+        Log densities of shape (n,).
+    """
+    dim = len(mode)
+    chol = np.linalg.cholesky(cov)
+    u = np.linalg.solve(chol, (z - mode).T)
+    maha = np.sum(u**2, axis=0)
+    return (
+        gammaln(0.5 * (df + dim))
+        - gammaln(0.5 * df)
+        - 0.5 * dim * np.log(df * np.pi)
+        - np.sum(np.log(np.diag(chol)))
+        - 0.5 * (df + dim) * np.log1p(maha / df)
+    )
+
+
+def importance_sample(
+    x_observed,
+    I_observed,
+    a,
+    b,
+    c,
+    d,
+    seed,
+    proposals=200000,
+    draws=10000,
+    df=4,
+    resample=True,
+    chains=4,
+    collapsed=False,
+):
+    """
+    Sample the lighthouse posterior by importance sampling from a Student-t
+    approximation centred on the posterior mode.
+
+    Proposals are independent, so the resampled draws need no thinning. Weights
+    are computed for all proposals in a single batched call of the log
+    posterior, and Pareto smoothed to report the Pareto-k tail diagnostic.
+
+    Parameters:
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities. If None, the `define_model_x` posterior is
+        sampled, otherwise the `define_model_xi` posterior.
+    - a, b, c, d : float
+        Prior bounds for alpha and beta.
+    - seed : int
+        The random seed to use for reproducibility.
+    - proposals : int, optional
+        Number of proposals drawn. Default is 200000.
+    - draws : int, optional
+        Number of resampled draws returned. Default is 10000.
+    - df : float, optional
+        Degrees of freedom of the Student-t proposal. Default is 4.
+    - resample : bool, optional
+        If True, return `draws` equally weighted draws resampled with
+        replacement. If False, return every proposal with its normalised log
+        weight in `sample_stats["log_weight"]`. Default is True.
+    - chains : int, optional
+        Number of pseudo-chains the resampled draws are split into, so that
+        r_hat can be computed. Ignored if `resample` is False. Default is 4.
+    - collapsed : bool, optional
+        If True and intensities are given, propose only (alpha, beta) and
+        weight them by the posterior with I0 integrated out (see
+        `log_marginal_likelihood_i`), then draw I0 exactly from its truncated
+        normal conditional, as `sample_I0` does. Default is False.
+
+    Returns:
+    - trace : arviz.InferenceData
+        Posterior draws, with ESS and Pareto-k stored in the posterior
+        attributes.
+
+    Raises:
+    - ValueError
+        If no proposal has a finite posterior density.
+    """
+    rng = np.random.default_rng(seed)
+
+    collapsed = collapsed and I_observed is not None
+    mode, cov = find_mode(x_observed, I_observed, a, b, c, d, collapsed)
+
+    # Inflate the Laplace covariance slightly to keep the proposal tails heavier
+    cov = 1.5 * cov
+    z = student_t_sample(mode, cov, df, proposals, rng)
+    log_weights = _log_target(z, x_observed, I_observed, a, b, c, d)
+    log_weights = log_weights - student_t_logpdf(z, mode, cov, df)
+    log_weights = np.where(np.isnan(log_weights), -np.inf, log_weights)
+    if not np.isfinite(log_weights).any():
+        raise ValueError(
+            "No importance sampling proposal has a finite posterior density."
+        )
+
+    # Pareto smoothed importance weights and tail diagnostic
+    log_weights, pareto_k = az.psislw(log_weights)
+    log_weights = log_weights - logsumexp(log_weights)
+    weights = np.exp(log_weights)
+    ess = 1.0 / np.sum(weights**2)
+
+    print(f"Importance sampling ESS: {ess:.0f} of {proposals} proposals")
+    print(f"Pareto k: {float(pareto_k):.2f}")
+    if pareto_k > 0.7:
+        print("Warning: Pareto k > 0.7, the importance weights are unreliable.")
+
+    params = _to_params(z)
+    if resample:
+        # Resampled draws are independent, split them into pseudo-chains
+        index = rng.choice(proposals, size=draws - draws % chains, p=weights)
+        params = params[index].reshape(chains, -1, params.shape[1])
+    else:
+        params = params[None]
+
+    if collapsed:
+        # Exact draws of I0 from its conditional given (alpha, beta)
+        _, _, loc, scale = collapsed_I0_moments(
+            params[..., 0], params[..., 1], x_observed, I_observed
+        )
+        lower = (np.log(PARETO_M) - loc) / scale
+        log_I0 = stats.truncnorm.rvs(
+            lower, np.inf, loc=loc, scale=scale, size=loc.shape, random_state=rng
+        )
+        params = np.concatenate([params, np.exp(log_I0)[..., None]], axis=-1)
+
+    var_names = ["alpha", "beta", "I0"][: params.shape[2]]
+    posterior = {name: params[..., i] for i, name in enumerate(var_names)}
+    sample_stats = None if resample else {"log_weight": log_weights[None, :]}
+
+    trace = az.from_dict(posterior=posterior, sample_stats=sample_stats)
+    trace.posterior.attrs["importance_ess"] = ess
+    trace.posterior.attrs["pareto_k"] = float(pareto_k)
+
+    return trace
@@ -0,0 +1,318 @@
+import numpy as np
+from scipy.special import log_ndtr
+
+
+# Pareto prior on I0, matching `define_model_xi`
+PARETO_ALPHA = 2
+PARETO_M = 0.01
+
+
+def log_prior(params, a, b, c, d):
+    """
+    Evaluate the log prior for a batch of parameter vectors.
+
+    Parameters:
+    - params : numpy.ndarray
+        Array of shape (..., 2) holding (alpha, beta) or (..., 3) holding
+        (alpha, beta, I0).
+    - a, b : float
+        Lower and upper bounds for the uniform prior of alpha.
+    - c, d : float
+        Lower and upper bounds for the uniform prior of beta.
+
+    Returns:
+    - numpy.ndarray
+        Log prior of shape params.shape[:-1], -inf outside the support.
+    """
+    alpha, beta = params[..., 0], params[..., 1]
+    inside = (alpha >= a) & (alpha <= b) & (beta >= c) & (beta <= d)
+    logp = np.where(inside, -np.log(b - a) - np.log(d - c), -np.inf)
+
+    if params.shape[-1] == 3:
+        I0 = params[..., 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_pareto = (
+                np.log(PARETO_ALPHA)
+                + PARETO_ALPHA * np.log(PARETO_M)
+                - (PARETO_ALPHA + 1) * np.log(I0)
+            )
+        logp = logp + np.where(I0 >= PARETO_M, log_pareto, -np.inf)
+
+    return logp
+
+
+def log_likelihood_x(alpha, beta, x_observed):
+    """
+    Evaluate the Cauchy log likelihood of the flash locations.
+
+    Parameters:
+    - alpha, beta : numpy.ndarray
+        Batches of lighthouse positions and distances.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+
+    Returns:
+    - numpy.ndarray
+        Log likelihood with the shape of alpha, summed over the flashes.
+    """
+    alpha = np.asarray(alpha)[..., None]
+    beta = np.asarray(beta)[..., None]
+    return np.sum(
+        np.log(beta / np.pi) - np.log(beta**2 + (x_observed - alpha) ** 2), axis=-1
+    )
+
+
+def log_likelihood_i(alpha, beta, I0, x_observed, I_observed):
+    """
+    Evaluate the lognormal log likelihood of the intensities.
+
+    Parameters:
+    - alpha, beta, I0 : numpy.ndarray
+        Batches of lighthouse positions, distances and intensities.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray
+        Observed intensities.
+
+    Returns:
+    - numpy.ndarray
+        Log likelihood with the shape of alpha, summed over the flashes.
+    """
+    alpha = np.asarray(alpha)[..., None]
+    beta = np.asarray(beta)[..., None]
+    I0 = np.asarray(I0)[..., None]
+    log_I = np.log(I_observed)
+    mu = np.log(I0) - np.log(beta**2 + (x_observed - alpha) ** 2)
+    return np.sum(-log_I - 0.5 * np.log(2 * np.pi) - 0.5 * (log_I - mu) ** 2, axis=-1)
+
+
+def log_posterior(params, x_observed, I_observed, a, b, c, d):
+    """
+    Evaluate the unnormalised log posterior for a batch of parameter vectors.
+
+    This is the NumPy equivalent of `define_model_x` (two parameters),
+    `define_model_xi_collapsed` (two parameters and intensities, with I0
+    integrated out by `log_marginal_likelihood_i`) and `define_model_xi`
+    (three parameters), evaluated for every row of `params` in one call.
+
+    Parameters:
+    - params : numpy.ndarray
+        Array of shape (..., 2) or (..., 3), see `log_prior`.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities.
+    - a, b, c, d : float
+        Prior bounds, see `log_prior`.
+
+    Returns:
+    - numpy.ndarray
+        Log posterior of shape params.shape[:-1], -inf outside the support.
+    """
+    params = np.asarray(params, dtype=float)
+    logp = log_prior(params, a, b, c, d)
+    inside = np.isfinite(logp)
+
+    # Clip out of support values so the likelihood stays finite
+    alpha = np.where(inside, params[..., 0], 0.5 * (a + b))
+    beta = np.where(inside, params[..., 1], 0.5 * (c + d))
+
+    loglik = log_likelihood_x(alpha, beta, x_observed)
+    if params.shape[-1] == 3:
+        I0 = np.where(inside, params[..., 2], 1.0)
+        loglik = loglik + log_likelihood_i(alpha, beta, I0, x_observed, I_observed)
+    elif I_observed is not None:
+        loglik = loglik + log_marginal_likelihood_i(
+            alpha, beta, x_observed, I_observed
+        )
+
+    return np.where(inside, logp + loglik, -np.inf)
+
+
+def collapsed_I0_moments(alpha, beta, x_observed, I_observed):
+    """
+    Compute the Gaussian moments of log I0 given (alpha, beta).
+
+    With y_k = log I_k + log d_k^2, the lognormal likelihood is a Gaussian in
+    log I0 with mean mean(y) and variance 1/n. Multiplying by the Pareto prior,
+    which is exponential in log I0, shifts the mean by -PARETO_ALPHA/n.
+
+    Parameters:
+    - alpha, beta : numpy.ndarray
+        Batches of lighthouse positions and distances.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray
+        Observed intensities.
+
+    Returns:
+    - y_mean : numpy.ndarray
+        Mean of y for each (alpha, beta).
+    - y_ss : numpy.ndarray
+        Sum of squared deviations of y from its mean.
+    - loc : numpy.ndarray
+        Mean of the (untruncated) conditional posterior of log I0.
+    - scale : float
+        Standard deviation of the conditional posterior of log I0.
+    """
+    alpha = np.asarray(alpha)[..., None]
+    beta = np.asarray(beta)[..., None]
+    n = len(x_observed)
+
+    y = np.log(I_observed) + np.log(beta**2 + (x_observed - alpha) ** 2)
+    y_mean = np.mean(y, axis=-1)
+    y_ss = np.sum((y - y_mean[..., None]) ** 2, axis=-1)
+    loc = y_mean - PARETO_ALPHA / n
+    scale = 1 / np.sqrt(n)
+
+    return y_mean, y_ss, loc, scale
+
+
+def log_marginal_likelihood_i(alpha, beta, x_observed, I_observed):
+    """
+    Evaluate the intensity likelihood with I0 integrated out against its prior.
+
+    Parameters:
+    - alpha, beta : numpy.ndarray
+        Batches of lighthouse positions and distances.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray
+        Observed intensities.
+
+    Returns:
+    - numpy.ndarray
+        The log of the integral over I0 of the lognormal likelihood times the
+        Pareto prior, with the shape of alpha.
+    """
+    n = len(x_observed)
+    y_mean, y_ss, loc, scale = collapsed_I0_moments(
+        alpha, beta, x_observed, I_observed
+    )
+    return (
+        -np.sum(np.log(I_observed))
+        - 0.5 * n * np.log(2 * np.pi)
+        - 0.5 * y_ss
+        + np.log(PARETO_ALPHA)
+        + PARETO_ALPHA * np.log(PARETO_M)
+        - PARETO_ALPHA * y_mean
+        + 0.5 * PARETO_ALPHA**2 / n
+        + 0.5 * np.log(2 * np.pi / n)
+        + log_ndtr((loc - np.log(PARETO_M)) / scale)
+    )
+
+
+def _sigmoid(u):
+    return 0.5 * (1 + np.tanh(0.5 * u))
+
+
+def from_unconstrained(u, a, b, c, d):
+    """
+    Map unconstrained parameters to (alpha, beta[, I0]).
+
+    Alpha and beta use a logistic transform onto their prior intervals and I0
+    uses I0 = PARETO_M + exp(u), matching PyMC3's interval and lower bound
+    transforms.
+
+    Parameters:
+    - u : numpy.ndarray
+        Array of shape (..., 2) or (..., 3) of unconstrained parameters.
+    - a, b, c, d : float
+        Prior bounds, see `log_prior`.
+
+    Returns:
+    - numpy.ndarray
+        Constrained parameters with the shape of u.
+    """
+    params = np.empty_like(u)
+    params[..., 0] = a + (b - a) * _sigmoid(u[..., 0])
+    params[..., 1] = c + (d - c) * _sigmoid(u[..., 1])
+    if u.shape[-1] == 3:
+        params[..., 2] = PARETO_M + np.exp(u[..., 2])
+    return params
+
+
+def to_unconstrained(params, a, b, c, d):
+    """
+    Map (alpha, beta[, I0]) to unconstrained parameters, the inverse of
+    `from_unconstrained`.
+
+    Parameters:
+    - params : numpy.ndarray
+        Array of shape (..., 2) or (..., 3) of constrained parameters.
+    - a, b, c, d : float
+        Prior bounds, see `log_prior`.
+
+    Returns:
+    - numpy.ndarray
+        Unconstrained parameters with the shape of params.
+    """
+    u = np.empty_like(params, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        u[..., 0] = np.log(params[..., 0] - a) - np.log(b - params[..., 0])
+        u[..., 1] = np.log(params[..., 1] - c) - np.log(d - params[..., 1])
+        if params.shape[-1] == 3:
+            u[..., 2] = np.log(params[..., 2] - PARETO_M)
+    return u
+
+
+def log_posterior_and_grad(u, x_observed, I_observed, a, b, c, d):
+    """
+    Evaluate the log posterior and its gradient in unconstrained space.
+
+    The log posterior includes the log Jacobian of `from_unconstrained`, so it
+    is the density sampled by gradient based samplers. Every row of `u` is
+    evaluated in one vectorised call.
+
+    Parameters:
+    - u : numpy.ndarray
+        Array of shape (n, 2) or (n, 3) of unconstrained parameters.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities, only used for three parameters.
+    - a, b, c, d : float
+        Prior bounds, see `log_prior`.
+
+    Returns:
+    - logp : numpy.ndarray
+        Log posterior of shape (n,), up to a constant.
+    - grad : numpy.ndarray
+        Gradient of the log posterior with respect to u, shape (n, dim).
+    """
+    # Saturated transforms give -inf, which samplers treat as divergent
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        s_alpha, s_beta = _sigmoid(u[:, 0]), _sigmoid(u[:, 1])
+        alpha = a + (b - a) * s_alpha
+        beta = c + (d - c) * s_beta
+
+        r = x_observed - alpha[:, None]
+        s = beta[:, None] ** 2 + r**2
+
+        # Cauchy likelihood of the flash locations
+        logp = np.sum(np.log(beta[:, None]) - np.log(s), axis=-1)
+        d_alpha = np.sum(2 * r / s, axis=-1)
+        d_beta = np.sum(1 / beta[:, None] - 2 * beta[:, None] / s, axis=-1)
+
+        grad = np.empty_like(u)
+        if u.shape[-1] == 3:
+            I0 = PARETO_M + np.exp(u[:, 2])
+            log_I0 = np.log(I0)
+
+            # Lognormal likelihood of the intensities and Pareto prior on I0
+            e = np.log(I_observed) - log_I0[:, None] + np.log(s)
+            logp = logp - 0.5 * np.sum(e**2, axis=-1) - (PARETO_ALPHA + 1) * log_I0
+            d_alpha = d_alpha + np.sum(2 * e * r / s, axis=-1)
+            d_beta = d_beta - np.sum(2 * e * beta[:, None] / s, axis=-1)
+            d_log_I0 = np.sum(e, axis=-1) - (PARETO_ALPHA + 1)
+
+            # Chain rule and log Jacobian of I0 = m + exp(u)
+            logp = logp + u[:, 2]
+            grad[:, 2] = d_log_I0 * np.exp(u[:, 2]) / I0 + 1
+
+        # Chain rule and log Jacobian of the logistic transforms
+        logp = logp + np.log(s_alpha * (1 - s_alpha)) + np.log(s_beta * (1 - s_beta))
+        grad[:, 0] = d_alpha * (b - a) * s_alpha * (1 - s_alpha) + 1 - 2 * s_alpha
+        grad[:, 1] = d_beta * (d - c) * s_beta * (1 - s_beta) + 1 - 2 * s_beta
+
+    return logp, grad
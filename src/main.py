@@ -1,32 +1,99 @@
+import os
+import json
+import argparse
 import warnings
+import numpy as np
 
-from reading_utils import read_and_prepare_data, read_config
-from sampling_utils import define_model_x, define_model_xi, sample_model
-from anlaysing_utils import (
-    thinning,
-    convergence_diagnostic,
-    mean_mle_analysis,
-    appendix_data,
-    cauchy,
-)
-from plotting_utils import (
-    plot_cauchy,
-    plot_cauchy_analysis,
-    trace_plot,
-    plotting_x,
-    plotting_xi,
-    appendix_plots,
+from reading_utils import (
+    read_and_prepare_data,
+    read_appended_data,
+    read_flashes,
+    append_flashes,
+    read_config,
+    read_precision,
 )
 
+# Heavy dependencies (pymc3, theano, arviz, pandas, corner, matplotlib) are
+# imported inside the subcommands that use them so light commands start fast.
 
 warnings.filterwarnings(
     "ignore", category=RuntimeWarning, message="overflow encountered in _beta_ppf"
 )
 
 
-def main(appendix=False):
+def setup_theano(compiledir=None):
+    """
+    Point Theano at a compile directory before it is first imported.
+
+    Parameters:
+    - compiledir : str, optional
+        Directory for Theano's compiled modules. If None, Theano's default
+        is used.
+    """
+    if compiledir is not None:
+        flags = os.environ.get("THEANO_FLAGS", "")
+        os.environ["THEANO_FLAGS"] = ",".join(
+            flag for flag in [flags, f"compiledir={compiledir}"] if flag
+        )
+
+
+def define_model(kind, x_observed, I_observed, model_params):
+    """
+    Define the requested lighthouse model.
+
+    Parameters:
+    - kind : str
+        One of 'x', 'xi' or 'xi-collapsed'.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray
+        Observed intensities.
+    - model_params : dict
+        Model parameters with keys 'a', 'b', 'c' and 'd'.
+
+    Returns:
+    - PyMC3 model object.
+    """
+    from sampling_utils import (
+        define_model_x,
+        define_model_xi,
+        define_model_xi_collapsed,
+    )
+
+    if kind == "x":
+        return define_model_x(x_observed, **model_params)
+    if kind == "xi":
+        return define_model_xi(x_observed, I_observed, **model_params)
+    return define_model_xi_collapsed(x_observed, I_observed, **model_params)
+
+
+def main(appendix=False, config="parameters.ini", data="lighthouse_flash_data.txt"):
+    from sampling_utils import (
+        define_model_x,
+        define_model_xi,
+        sample_model,
+        set_precision,
+    )
+    from anlaysing_utils import (
+        thinning,
+        convergence_diagnostic,
+        mean_mle_analysis,
+        appendix_data,
+        cauchy,
+    )
+    from plotting_utils import (
+        plot_cauchy,
+        plot_cauchy_analysis,
+        trace_plot,
+        plotting_x,
+        plotting_xi,
+        appendix_plots,
+    )
+
     # Read the configuration file
-    model_params, sampling_params, seed = read_config("parameters.ini")
+    model_params, sampling_params, seed = read_config(config)
+    precision = read_precision(config)
+    set_precision(precision)
 
     ## iii)
     # Cauchy MLE and mean flash location analysis
@@ -35,21 +102,21 @@ def main(appendix=False):
     plot_cauchy_analysis(*analysis_results)
 
     # Read and prepare the data
-    x_observed, I_observed = read_and_prepare_data("lighthouse_flash_data.txt")
+    x_observed, I_observed = read_and_prepare_data(data, precision)
 
     # Define models
     model_x = define_model_x(x_observed, **model_params)
     model_xi = define_model_xi(x_observed, I_observed, **model_params)
 
     ## v)  Flash Locations
-    trace_x = sample_model(model_x, seed, **sampling_params)
+    trace_x = sample_model(model_x, seed, precision=precision, **sampling_params)
     trace_plot(trace_x)
     thinned_trace_x = thinning(trace_x)
     convergence_diagnostic(thinned_trace_x)
     plotting_x(thinned_trace_x)
 
     ## vii) Flash Locations and Intensities
-    trace_xi = sample_model(model_xi, seed, **sampling_params)
+    trace_xi = sample_model(model_xi, seed, precision=precision, **sampling_params)
     trace_plot(trace_xi)
     thinned_trace_xi = thinning(trace_xi)
     convergence_diagnostic(thinned_trace_xi)
@@ -68,5 +135,318 @@ def main(appendix=False):
         appendix_plots(thinned_trace_xi)
 
 
+def load_command(args):
+    precision = read_precision(args.config)
+    x_observed, I_observed = read_and_prepare_data(args.data, precision)
+    print(f"Read {len(x_observed)} flashes from {args.data}")
+    print(f"x: min {x_observed.min():.3f}, max {x_observed.max():.3f}")
+    print(f"I: min {I_observed.min():.3f}, max {I_observed.max():.3f}")
+
+
+def mle_command(args):
+    from anlaysing_utils import mean_mle_analysis, cauchy, parallel_mean_median
+
+    _, _, seed = read_config(args.config)
+
+    if args.stream:
+        results = parallel_mean_median(seed, args.stream, args.processes)
+        for n, mean, median in zip(results["n"], results["mean"], results["median"]):
+            print(f"N = {n:>12d}: mean {mean: .4f}, median {median: .5f}")
+        if args.plot:
+            from plotting_utils import plot_mean_median_convergence
+
+            plot_mean_median_convergence(results)
+        return
+
+    analysis_results = mean_mle_analysis(seed)
+    _, _, _, mean, mode, _ = analysis_results
+    print(f"Sample mean: {mean:.4f}")
+    print(f"Sample median: {mode:.4f}")
+
+    if args.plot:
+        from plotting_utils import plot_cauchy, plot_cauchy_analysis
+
+        plot_cauchy(cauchy)
+        plot_cauchy_analysis(*analysis_results)
+
+
+def sample_command(args):
+    model_params, sampling_params, seed = read_config(args.config)
+    precision = read_precision(args.config)
+    x_observed, I_observed = read_and_prepare_data(args.data, precision)
+
+    if args.sampler == "numpy":
+        from hmc_utils import sample_nuts
+
+        if args.model == "xi-collapsed":
+            print("Error: The NumPy sampler supports the 'x' and 'xi' models.")
+            return
+        I_observed = I_observed if args.model == "xi" else None
+        trace = sample_nuts(
+            x_observed,
+            I_observed,
+            seed,
+            precision=precision,
+            **sampling_params,
+            **model_params,
+        )
+    else:
+        setup_theano(args.compiledir)
+        from sampling_utils import sample_model, sample_I0, set_precision
+
+        set_precision(precision)
+        model = define_model(args.model, x_observed, I_observed, model_params)
+        trace = sample_model(model, seed, precision=precision, **sampling_params)
+        if args.model == "xi-collapsed":
+            trace = sample_I0(trace, x_observed, I_observed, seed)
+
+    from export_utils import tag_run, data_hash
+
+    config = {"model": args.model, **model_params, **sampling_params}
+    tag_run(trace, config, seed, data_hash(x_observed, I_observed))
+    trace.to_netcdf(args.output)
+    print(f"Trace written to {args.output}")
+
+
+def update_command(args):
+    import arviz as az
+
+    model_params, sampling_params, seed = read_config(args.config)
+    precision = read_precision(args.config)
+    state_file = f"{args.output}.state.json"
+    flash_file = f"{args.output}.flashes.bin"
+
+    # Reader state of the previous fit, if there is one
+    state = None
+    if all(os.path.exists(path) for path in (state_file, flash_file, args.output)):
+        with open(state_file) as file:
+            state = json.load(file)
+
+    x_new, I_new, state = read_appended_data(args.data, state, precision)
+    previous_rows = state["rows"] - len(x_new) if state["appended"] else 0
+    if state["appended"] and len(x_new) == 0:
+        print(f"No new flashes in {args.data}, {args.output} is up to date.")
+        return
+    if state["appended"]:
+        # Flashes of the previous fit from the binary store, not the text file
+        x_observed, I_observed = read_flashes(flash_file, previous_rows, precision)
+        x_observed = np.concatenate([x_observed, x_new])
+        I_observed = np.concatenate([I_observed, I_new])
+        previous = az.from_netcdf(args.output)
+        sampling_params["tune"] = args.tune
+        print(f"Re-fitting with {len(x_new)} new flashes, {len(x_observed)} in total")
+    else:
+        x_observed, I_observed, previous = x_new, I_new, None
+        print(f"Fitting {len(x_observed)} flashes")
+
+    if args.sampler == "numpy":
+        from hmc_utils import sample_nuts
+
+        if args.model == "xi-collapsed":
+            print("Error: The NumPy sampler supports the 'x' and 'xi' models.")
+            return
+        trace = sample_nuts(
+            x_observed,
+            I_observed if args.model == "xi" else None,
+            seed,
+            init_trace=previous,
+            precision=precision,
+            **sampling_params,
+            **model_params,
+        )
+    else:
+        setup_theano(args.compiledir)
+        from sampling_utils import (
+            sample_model,
+            sample_model_incremental,
+            sample_I0,
+            set_precision,
+        )
+
+        set_precision(precision)
+        model = define_model(args.model, x_observed, I_observed, model_params)
+        if previous is None:
+            trace = sample_model(model, seed, precision=precision, **sampling_params)
+        else:
+            trace = sample_model_incremental(
+                model, previous, seed, precision=precision, **sampling_params
+            )
+        if args.model == "xi-collapsed":
+            trace = sample_I0(trace, x_observed, I_observed, seed)
+
+    from export_utils import tag_run, data_hash
+
+    config = {"model": args.model, **model_params, **sampling_params}
+    tag_run(trace, config, seed, data_hash(x_observed, I_observed))
+
+    # Store only the new flashes, then replace the previous trace atomically
+    # (it may still be open for reading) and finally the reader state
+    append_flashes(flash_file, x_new, I_new, previous_rows)
+    trace.to_netcdf(f"{args.output}.tmp")
+    os.replace(f"{args.output}.tmp", args.output)
+    with open(state_file, "w") as file:
+        json.dump(state, file)
+    print(f"Trace written to {args.output}")
+
+
+def diagnose_command(args):
+    import arviz as az
+    from anlaysing_utils import thinning, convergence_diagnostic, appendix_data
+
+    trace = az.from_netcdf(args.trace)
+    thinned_trace = thinning(trace)
+    diagnostics = convergence_diagnostic(thinned_trace)
+    if args.appendix:
+        appendix_data(trace)
+        appendix_data(thinned_trace)
+
+    if args.export:
+        from export_utils import export_run, run_metadata, data_hash
+
+        # Provenance recorded by 'sample', or given explicitly for older traces
+        metadata = run_metadata(trace)
+        if metadata is None:
+            if args.config is None or args.data is None:
+                print(
+                    f"Error: {args.trace} has no run metadata, pass the --config "
+                    "and --data it was sampled with to export it."
+                )
+                return
+            model_params, sampling_params, seed = read_config(args.config)
+            precision = read_precision(args.config)
+            x_observed, I_observed = read_and_prepare_data(args.data, precision)
+            metadata = (
+                {**model_params, **sampling_params},
+                seed,
+                data_hash(x_observed, I_observed),
+            )
+
+        config, seed, data_digest = metadata
+        export_run(
+            args.export,
+            thinned_trace,
+            diagnostics,
+            config=config,
+            seed=seed,
+            data_digest=data_digest,
+        )
+        print(f"Thinned trace and diagnostics exported to {args.export}")
+
+
+def plot_command(args):
+    import arviz as az
+    from anlaysing_utils import thinning
+    from plotting_utils import trace_plot, plotting_x, plotting_xi, appendix_plots
+
+    trace = az.from_netcdf(args.trace)
+    trace_plot(trace)
+    thinned_trace = thinning(trace)
+    if "I0" in trace.posterior:
+        plotting_xi(thinned_trace)
+    else:
+        plotting_x(thinned_trace)
+    if args.appendix:
+        appendix_plots(trace)
+        appendix_plots(thinned_trace)
+
+
+def batch_command(args):
+    setup_theano(args.compiledir)
+    main(appendix=args.appendix, config=args.config, data=args.data)
+
+
+def serve_command(args):
+    from service_utils import serve
+
+    # The batch sampling settings are too slow per request, the service uses
+    # its own defaults (SERVICE_SAMPLING_PARAMS)
+    model_params, _, _ = read_config(args.config)
+    serve(
+        model_params,
+        host=args.host,
+        port=args.port,
+        processes=args.workers,
+        max_queue=args.max_queue,
+        trace_dir=args.trace_dir,
+    )
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line arguments.
+
+    Parameters:
+    - argv : list of str, optional
+        Arguments to parse. Defaults to sys.argv[1:].
+
+    Returns:
+    - args : argparse.Namespace
+        The parsed arguments, with `func` set to the subcommand to run.
+    """
+    parser = argparse.ArgumentParser(description="The Lighthouse Problem")
+    subparsers = parser.add_subparsers(dest="command")
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--config", default="parameters.ini")
+    common.add_argument("--data", default="lighthouse_flash_data.txt")
+    common.add_argument("--compiledir", default=None)
+
+    load = subparsers.add_parser("load", parents=[common], help="Read the data")
+    load.set_defaults(func=load_command)
+
+    mle = subparsers.add_parser("mle", parents=[common], help="Mean vs MLE study")
+    mle.add_argument("--plot", action="store_true")
+    mle.add_argument("--stream", type=int, default=None, help="Streamed samples")
+    mle.add_argument("--processes", type=int, default=1)
+    mle.set_defaults(func=mle_command)
+
+    sample = subparsers.add_parser("sample", parents=[common], help="Run NUTS")
+    sample.add_argument("--model", choices=["x", "xi", "xi-collapsed"], default="x")
+    sample.add_argument("--sampler", choices=["pymc3", "numpy"], default="pymc3")
+    sample.add_argument("--output", default="trace.nc")
+    sample.set_defaults(func=sample_command)
+
+    update = subparsers.add_parser(
+        "update", parents=[common], help="Re-fit after new flashes are appended"
+    )
+    update.add_argument("--model", choices=["x", "xi", "xi-collapsed"], default="x")
+    update.add_argument("--sampler", choices=["pymc3", "numpy"], default="pymc3")
+    update.add_argument("--output", default="trace.nc")
+    update.add_argument("--tune", type=int, default=100, help="Re-tuning steps")
+    update.set_defaults(func=update_command)
+
+    diagnose = subparsers.add_parser("diagnose", help="Diagnose a saved trace")
+    diagnose.add_argument("trace")
+    diagnose.add_argument("--appendix", action="store_true")
+    diagnose.add_argument("--export", default=None, help="Compressed archive file")
+    # No defaults, so an export never records settings the trace was not run with
+    diagnose.add_argument("--config", default=None)
+    diagnose.add_argument("--data", default=None)
+    diagnose.set_defaults(func=diagnose_command)
+
+    plot = subparsers.add_parser("plot", help="Plot a saved trace")
+    plot.add_argument("trace")
+    plot.add_argument("--appendix", action="store_true")
+    plot.set_defaults(func=plot_command)
+
+    batch = subparsers.add_parser("batch", parents=[common], help="Full analysis")
+    batch.add_argument("--appendix", action="store_true")
+    batch.set_defaults(func=batch_command)
+
+    serve = subparsers.add_parser("serve", parents=[common], help="Run the service")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--workers", type=int, default=None)
+    serve.add_argument("--max-queue", type=int, default=256)
+    serve.add_argument("--trace-dir", default="traces")
+    serve.set_defaults(func=serve_command)
+
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    main(appendix=True)
+    args = parse_args()
+    if args.command is None:
+        main(appendix=True)
+    else:
+        args.func(args)
@@ -0,0 +1,281 @@
+import numpy as np
+
+
+def _combine(a, b):
+    """
+    Combine two (count, mean, M2) Welford accumulators (Chan et al.).
+    """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n == 0:
+        return a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    m2 = m2_a + m2_b + delta**2 * n_a * n_b / n
+    return n, mean, m2
+
+
+class ChainStatistics:
+    """
+    Streaming statistics of a single chain.
+
+    Keeps a Welford accumulator over all draws and a list of batch
+    accumulators for batch-means ESS and split R-hat. When the number of
+    batches reaches twice `max_batches`, neighbouring batches are merged and
+    the batch size doubles, so memory stays bounded however long the chain.
+
+    Parameters:
+    - n_vars : int
+        Number of scalar variables tracked.
+    - max_batches : int, optional
+        Number of batches kept after each merge. Default is 32.
+    """
+
+    def __init__(self, n_vars, max_batches=32):
+        self.max_batches = max_batches
+        self.batch_size = 1
+        self.total = (0, np.zeros(n_vars), np.zeros(n_vars))
+        self.batches = []
+        self.current = (0, np.zeros(n_vars), np.zeros(n_vars))
+        self.divergences = 0
+
+    def update(self, values, diverging=False):
+        """
+        Add a draw to the chain statistics.
+
+        Parameters:
+        - values : numpy.ndarray
+            Values of the tracked variables at this draw.
+        - diverging : bool, optional
+            Whether the transition was divergent.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        single = (1, values, np.zeros_like(values))
+        self.total = _combine(self.total, single)
+        self.current = _combine(self.current, single)
+        self.divergences += int(diverging)
+
+        if self.current[0] == self.batch_size:
+            self.batches.append(self.current)
+            self.current = (0, np.zeros_like(values), np.zeros_like(values))
+
+            if len(self.batches) == 2 * self.max_batches:
+                self.batches = [
+                    _combine(self.batches[i], self.batches[i + 1])
+                    for i in range(0, len(self.batches), 2)
+                ]
+                self.batch_size *= 2
+
+    @property
+    def n(self):
+        return self.total[0]
+
+    @property
+    def mean(self):
+        return self.total[1]
+
+    @property
+    def variance(self):
+        n, _, m2 = self.total
+        return m2 / max(n - 1, 1)
+
+    def ess(self):
+        """
+        Batch-means effective sample size of each variable.
+
+        Returns:
+        - numpy.ndarray
+            ESS per variable, NaN with fewer than two batches.
+        """
+        if len(self.batches) < 2:
+            return np.full_like(self.mean, np.nan)
+        batch_means = np.array([mean for _, mean, _ in self.batches])
+        batch_var = np.var(batch_means, axis=0, ddof=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ess = self.n * self.variance / (self.batch_size * batch_var)
+        return np.minimum(ess, self.n)
+
+    def halves(self):
+        """
+        Accumulators of the first and second half of the completed batches.
+        """
+        k = len(self.batches) // 2
+        first, second = self.batches[:k], self.batches[-k:]
+        empty = (0, np.zeros_like(self.mean), np.zeros_like(self.mean))
+        first_half, second_half = empty, empty
+        for batch in first:
+            first_half = _combine(first_half, batch)
+        for batch in second:
+            second_half = _combine(second_half, batch)
+        return first_half, second_half
+
+
+def split_r_hat(chains):
+    """
+    Compute the split R-hat of each variable from streaming chain statistics.
+
+    Parameters:
+    - chains : list of ChainStatistics
+        Statistics of every chain.
+
+    Returns:
+    - numpy.ndarray
+        Split R-hat per variable, NaN if the chains are too short.
+    """
+    halves = [half for chain in chains for half in chain.halves()]
+    lengths = [n for n, _, _ in halves]
+    if len(halves) < 2 or min(lengths) < 2:
+        return np.full_like(chains[0].mean, np.nan)
+
+    # Use the shortest half length so all sequences are treated equally
+    n = min(lengths)
+    means = np.array([mean for _, mean, _ in halves])
+    variances = np.array([m2 / (count - 1) for count, _, m2 in halves])
+
+    W = variances.mean(axis=0)
+    B_over_n = means.var(axis=0, ddof=1)
+    var_hat = (n - 1) / n * W + B_over_n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.sqrt(var_hat / W)
+
+
+class ConvergenceMonitor:
+    """
+    Live convergence monitor for MCMC sampling with early abort.
+
+    The monitor is updated after every draw, either directly through
+    `update` or as a PyMC3 `pm.sample` callback. Every `report_every` draws
+    it computes per-chain means, variances and batch-means ESS, the split
+    R-hat across chains and divergence counts, and passes them to
+    `on_report` (or prints them). Once `min_draws` draws per chain have been
+    taken, sampling is aborted by raising KeyboardInterrupt, which PyMC3
+    handles by returning the draws taken so far, if R-hat or the number of
+    divergences exceed their thresholds.
+
+    Parameters:
+    - var_names : list of str, optional
+        Variables to monitor. Defaults to the untransformed variables of the
+        first draw.
+    - report_every : int, optional
+        Number of draws per chain between reports. Default is 500.
+    - min_draws : int, optional
+        Number of draws per chain before the thresholds are checked.
+        Default is 1000.
+    - max_r_hat : float, optional
+        Split R-hat above which sampling is aborted. Default is 1.1.
+    - max_divergences : int, optional
+        Total number of divergences above which sampling is aborted.
+        Default is 100.
+    - on_report : callable, optional
+        Called with the status dictionary at every report. If None, a short
+        summary is printed.
+    """
+
+    def __init__(
+        self,
+        var_names=None,
+        report_every=500,
+        min_draws=1000,
+        max_r_hat=1.1,
+        max_divergences=100,
+        on_report=None,
+    ):
+        self.var_names = var_names
+        self.report_every = report_every
+        self.min_draws = min_draws
+        self.max_r_hat = max_r_hat
+        self.max_divergences = max_divergences
+        self.on_report = on_report
+        self.chains = {}
+        self.aborted = False
+        self.reason = None
+
+    def update(self, chain, values, diverging=False):
+        """
+        Add a draw from one chain and report or abort if due.
+
+        Parameters:
+        - chain : int
+            Index of the chain the draw belongs to.
+        - values : numpy.ndarray
+            Values of the monitored variables, in the order of `var_names`.
+        - diverging : bool, optional
+            Whether the transition was divergent.
+
+        Raises:
+        - KeyboardInterrupt
+            If a threshold is crossed, to stop the sampler.
+        """
+        if chain not in self.chains:
+            self.chains[chain] = ChainStatistics(len(values))
+        stats = self.chains[chain]
+        stats.update(values, diverging)
+
+        # Report when the slowest chain crosses a reporting boundary
+        n_min = min(c.n for c in self.chains.values())
+        if stats.n == n_min and n_min % self.report_every == 0:
+            status = self.status()
+            if self.on_report is None:
+                self._print_status(status)
+            else:
+                self.on_report(status)
+            if n_min >= self.min_draws:
+                self._check(status)
+
+    def __call__(self, trace, draw):
+        """
+        PyMC3 `pm.sample` callback, skipping tuning draws.
+        """
+        if draw.tuning:
+            return
+        point = draw.point
+        if self.var_names is None:
+            names = [name for name in point if not name.endswith("__")]
+            self.var_names = names or list(point)
+        values = np.concatenate([np.ravel(point[name]) for name in self.var_names])
+        stats = draw.stats[0] if draw.stats else {}
+        self.update(draw.chain, values, stats.get("diverging", False))
+
+    def status(self):
+        """
+        Current streaming statistics.
+
+        Returns:
+        - status : dict
+            'draws' (per chain), 'mean', 'variance' and 'ess' (chains x
+            variables), 'r_hat' (per variable) and 'divergences' (per chain).
+        """
+        chains = [self.chains[c] for c in sorted(self.chains)]
+        return {
+            "draws": np.array([c.n for c in chains]),
+            "mean": np.array([c.mean for c in chains]),
+            "variance": np.array([c.variance for c in chains]),
+            "ess": np.array([c.ess() for c in chains]),
+            "r_hat": split_r_hat(chains),
+            "divergences": np.array([c.divergences for c in chains]),
+        }
+
+    def _print_status(self, status):
+        r_hat = status["r_hat"][np.isfinite(status["r_hat"])]
+        ess = status["ess"].sum(axis=0)
+        ess = ess[np.isfinite(ess)]
+        print(
+            f"Draw {status['draws'].min()}: "
+            f"max r_hat {r_hat.max() if r_hat.size else np.nan:.3f}, "
+            f"min ESS {ess.min() if ess.size else np.nan:.0f}, "
+            f"divergences {status['divergences'].sum()}"
+        )
+
+    def _check(self, status):
+        if np.any(status["r_hat"] > self.max_r_hat):
+            self.reason = f"r_hat above {self.max_r_hat}"
+        elif status["divergences"].sum() > self.max_divergences:
+            self.reason = f"more than {self.max_divergences} divergences"
+        else:
+            return
+
+        self.aborted = True
+        bad = np.flatnonzero(status["divergences"] > 0).tolist()
+        print(f"Aborting sampling: {self.reason} (chains with divergences: {bad})")
+        raise KeyboardInterrupt
@@ -4,6 +4,7 @@ import arviz as az
 from matplotlib import pyplot as plt
 from matplotlib.ticker import NullFormatter
 from reading_utils import read_config
+from anlaysing_utils import geweke_trace
 
 
 # Read the configuration file
@@ -102,6 +103,38 @@ def plot_cauchy_analysis(x, x_true, y_true, mean, mode, bins_number):
     plt.show()
 
 
+def plot_mean_median_convergence(results):
+    """
+    Plot the sample mean and quantiles of Cauchy samples against sample size.
+
+    Parameters:
+    - results : dict
+        Output of `streaming_mean_median` or `parallel_mean_median`.
+
+    Notes:
+    - The x-axis is logarithmic in the number of samples.
+    - The true location (alpha = 0) is marked with a dashed line; the median
+    converges to it while the mean does not.
+    - The function uses Matplotlib for plotting and displays the plot directly.
+    """
+    n = results["n"]
+    plt.plot(n, results["mean"], color="magenta", label="Sample Mean")
+    for level, values in zip(results["levels"], results["quantiles"].T):
+        if level == 0.5:
+            plt.plot(n, values, color="orange", label="Sample Median")
+        else:
+            plt.plot(n, values, color="orange", linestyle=":", alpha=0.7)
+    plt.axhline(0, color="k", linestyle="dashed", linewidth=1, label=r"$\alpha$")
+
+    plt.xscale("log")
+    plt.legend()
+    plt.xlabel("Number of samples")
+    plt.ylabel("Estimate")
+
+    plt.tight_layout()
+    plt.show()
+
+
 def trace_plot(trace, figsize=(12, 8)):
     """
     Generate a trace plot for each variable in the provided MCMC trace.
@@ -360,7 +393,7 @@ def marginal_posterior(trace, bins=50, figsize=(12, 8)):
     plt.show()
 
 
-def plot_geweke(trace, intervals=15):
+def plot_geweke(trace, intervals=15, geweke=None):
     """
     Plot the Geweke diagnostic for each variable in the MCMC trace.
 
@@ -375,8 +408,12 @@ def plot_geweke(trace, intervals=15):
     - intervals : int, optional
         The number of intervals to divide the trace into for the Geweke diagnostic.
         Default is 15.
+    - geweke : tuple, optional
+        Precomputed output of `geweke_trace`, e.g. shared with `geweke_gate`.
+        If None, it is computed from the trace.
 
     Notes:
+    - Z-scores are computed per chain and plotted with one colour per chain.
     - The function plots z-scores and marks the ±2 standard deviation range with
     horizontal lines.
     - Z-scores within ±2 suggest that the segment means are within 2 standard deviations
@@ -384,7 +421,10 @@ def plot_geweke(trace, intervals=15):
       indicating convergence.
     - The function uses Matplotlib for plotting and displays the plot directly.
     """
-    var_names = list(trace.posterior.data_vars)
+    # Geweke z-scores for every variable, chain and interval at once
+    if geweke is None:
+        geweke = geweke_trace(trace, intervals=intervals)
+    var_names, iterations, z_scores = geweke
 
     # Determine the number of subplots needed
     n_vars = len(var_names)
@@ -395,17 +435,9 @@ def plot_geweke(trace, intervals=15):
     )
 
     for i, var_name in enumerate(var_names):
-        # Calculate Geweke diagnostic for each variable
-        var_samples = trace.posterior[
-            var_name
-        ].values.flatten()  # Flatten in case of multidimensional variables
-        geweke_results = az.geweke(var_samples, intervals=intervals)
-
-        # Extract iterations and z-scores
-        iterations, z_scores = geweke_results[:, 0], geweke_results[:, 1]
-
-        # Plot Geweke diagnostic
-        axes[i, 0].scatter(iterations, z_scores, alpha=0.6)
+        # Plot Geweke diagnostic for each chain
+        for chain_z_scores in z_scores[i]:
+            axes[i, 0].scatter(iterations, chain_z_scores, alpha=0.6)
         axes[i, 0].axhline(y=2, color="r", linestyle="--", label=r"2 $\sigma$")
         axes[i, 0].axhline(y=-2, color="r", linestyle="--")
         axes[i, 0].set_ylabel("Z-score")
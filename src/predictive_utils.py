@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+from anlaysing_utils import trigonometric
+
+
+def _test_statistics(x, log_I=None):
+    """
+    Compute per-dataset test statistics along the last axis.
+    """
+    q25, q50, q75 = np.percentile(x, [25, 50, 75], axis=-1)
+    statistics = {"x_median": q50, "x_iqr": q75 - q25}
+    if log_I is not None:
+        statistics["logI_mean"] = np.mean(log_I, axis=-1)
+        statistics["logI_sd"] = np.std(log_I, axis=-1)
+    return statistics
+
+
+def _count_below(simulated, observed):
+    """
+    Count the simulated values at or below each observed value.
+    """
+    return np.searchsorted(np.sort(simulated, axis=None), observed, side="right")
+
+
+def posterior_predictive(
+    trace,
+    x_observed,
+    I_observed=None,
+    seed=None,
+    max_bytes=2**28,
+    quantiles=(0.05, 0.5, 0.95),
+    tail_levels=(0.01, 0.05),
+):
+    """
+    Run a posterior predictive check, streaming summary statistics over draws.
+
+    For every posterior draw a replicate dataset of the same size as the data
+    is simulated: flash locations via `trigonometric` with uniform angles and,
+    if the trace contains I0, lognormal intensities. Draws are processed in
+    chunks sized to stay under `max_bytes`, and only running counts and
+    per-draw test statistics are kept, so the full draws x flashes matrix is
+    never held in memory.
+
+    Parameters
+    ----------
+    trace : arviz.InferenceData
+        Output of `sample_model` or `thinning`.
+    x_observed : numpy.ndarray
+        Observed flash locations.
+    I_observed : numpy.ndarray, optional
+        Observed intensities. Only used if the trace contains I0.
+    seed : int, optional
+        The random seed for reproducibility.
+    max_bytes : int, optional
+        Approximate memory cap for each chunk of simulations. Default is 256 MB.
+    quantiles : tuple of float, optional
+        Quantiles of the replicated test statistics to report.
+    tail_levels : tuple of float, optional
+        Tail probabilities at which observed thresholds are set for the
+        tail-exceedance rates.
+
+    Returns
+    -------
+    results : dict
+        'pit_x' and (with intensities) 'pit_logI' hold the PIT value of each
+        observation; 'statistics' is a DataFrame of observed test statistics,
+        their predictive quantiles and posterior predictive p-values;
+        'tail_rates' is a DataFrame comparing observed and predicted fractions
+        of flashes beyond the observed tail thresholds.
+    """
+    rng = np.random.default_rng(seed)
+
+    alpha = trace.posterior["alpha"].values.ravel().astype(np.float64)
+    beta = trace.posterior["beta"].values.ravel().astype(np.float64)
+    with_intensity = "I0" in trace.posterior and I_observed is not None
+    if with_intensity:
+        I0 = trace.posterior["I0"].values.ravel().astype(np.float64)
+        log_I_observed = np.log(np.asarray(I_observed, dtype=np.float64))
+
+    x_observed = np.asarray(x_observed, dtype=np.float64)
+    n_draws, n_flashes = len(alpha), len(x_observed)
+
+    # Up to about seven float64 arrays of shape (chunk, flashes) are alive at
+    # once (replicates, the in-place intensity temporary and the copies made
+    # by sorting and percentiles), budget for eight
+    chunk = int(max(1, min(n_draws, max_bytes // (64 * n_flashes))))
+
+    # Observed tail thresholds for the exceedance rates
+    observed = {"x": x_observed}
+    if with_intensity:
+        observed["logI"] = log_I_observed
+    thresholds = {
+        name: [(np.quantile(obs, p), np.quantile(obs, 1 - p)) for p in tail_levels]
+        for name, obs in observed.items()
+    }
+
+    # Running accumulators, using integer counts to avoid precision loss
+    below = {name: np.zeros(n_flashes, dtype=np.int64) for name in observed}
+    exceed = {name: np.zeros(len(tail_levels), dtype=np.int64) for name in observed}
+    replicated = {}
+
+    for start in range(0, n_draws, chunk):
+        stop = min(start + chunk, n_draws)
+        size = (stop - start, n_flashes)
+
+        theta = rng.uniform(-np.pi / 2, np.pi / 2, size)
+        x_rep = trigonometric(theta, alpha[start:stop, None], beta[start:stop, None])
+        del theta
+        simulated = {"x": x_rep}
+
+        log_I_rep = None
+        if with_intensity:
+            # log I = log I0 - log d^2 + noise, built in place
+            log_d2 = x_rep - alpha[start:stop, None]
+            log_d2 **= 2
+            log_d2 += beta[start:stop, None] ** 2
+            np.log(log_d2, out=log_d2)
+            log_I_rep = rng.standard_normal(size)
+            log_I_rep -= log_d2
+            del log_d2
+            log_I_rep += np.log(I0[start:stop, None])
+            simulated["logI"] = log_I_rep
+
+        for name, values in simulated.items():
+            below[name] += _count_below(values, observed[name])
+            for i, (lower, upper) in enumerate(thresholds[name]):
+                exceed[name][i] += np.count_nonzero((values < lower) | (values > upper))
+
+        for name, values in _test_statistics(x_rep, log_I_rep).items():
+            replicated.setdefault(name, []).append(values)
+
+    total = n_draws * n_flashes
+    results = {f"pit_{name}": below[name] / total for name in observed}
+
+    # Test statistics: observed value, predictive quantiles and p-value
+    observed_statistics = _test_statistics(
+        x_observed, log_I_observed if with_intensity else None
+    )
+    rows = {}
+    for name, values in replicated.items():
+        values = np.concatenate(values)
+        row = {"observed": observed_statistics[name]}
+        for q, value in zip(quantiles, np.quantile(values, quantiles)):
+            row[f"q{q:g}"] = value
+        row["p_value"] = np.mean(values >= observed_statistics[name])
+        rows[name] = row
+    results["statistics"] = pd.DataFrame(rows).T
+
+    # Tail exceedance: observed vs predicted fraction beyond each threshold
+    rows = []
+    for name, obs in observed.items():
+        for i, level in enumerate(tail_levels):
+            lower, upper = thresholds[name][i]
+            rows.append(
+                {
+                    "variable": name,
+                    "level": level,
+                    "observed": np.mean((obs < lower) | (obs > upper)),
+                    "predicted": exceed[name][i] / total,
+                }
+            )
+    results["tail_rates"] = pd.DataFrame(rows)
+
+    return results
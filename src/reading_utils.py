@@ -1,4 +1,6 @@
+import os
 import sys
+import hashlib
 import numpy as np
 import configparser as cfg
 
@@ -42,7 +44,7 @@ def read_data(file_path):
     return column1, column2
 
 
-def read_and_prepare_data(file_path):
+def read_and_prepare_data(file_path, precision="float32"):
     """
     Read data from a text file and return two numpy arrays.
 
@@ -52,6 +54,9 @@ def read_and_prepare_data(file_path):
     Parameters:
     - file_path : str
         Path to the text file containing the data.
+    - precision : str, optional
+        Floating point precision of the arrays, 'float32' or 'float64'.
+        Default is 'float32'.
 
     Returns:
     - x_observed : numpy.ndarray
@@ -60,11 +65,145 @@ def read_and_prepare_data(file_path):
         Numpy array containing data from the second column of the file.
     """
     data = read_data(file_path)
-    x_observed = np.array(data[0], dtype=np.float32)
-    I_observed = np.array(data[1], dtype=np.float32)
+    x_observed = np.array(data[0], dtype=precision)
+    I_observed = np.array(data[1], dtype=precision)
     return x_observed, I_observed
 
 
+def _tail_hash(file, offset, window=4096):
+    """
+    SHA-256 of the last `window` bytes before `offset` in an open binary file.
+    """
+    start = max(0, offset - window)
+    file.seek(start)
+    return hashlib.sha256(file.read(offset - start)).hexdigest()
+
+
+def read_appended_data(file_path, state=None, precision="float32"):
+    """
+    Read only the rows appended to a data file since it was last read.
+
+    The returned state records the byte offset of the processed prefix and a
+    hash of its last 4 KiB. On the next call the hash is checked and parsing
+    resumes at the offset, so the cost depends on the new rows only. Rows are
+    parsed like `read_data`. If the file was truncated or rewritten the whole
+    file is read again. A final line without a newline is left for the next
+    call, as it may still be written.
+
+    Parameters:
+    - file_path : str
+        Path to the text file containing the data.
+    - state : dict, optional
+        State returned by the previous call. If None, the whole file is read.
+    - precision : str, optional
+        Floating point precision of the arrays, 'float32' or 'float64'.
+        Default is 'float32'.
+
+    Returns:
+    - x_new : numpy.ndarray
+        Flash locations of the new rows.
+    - I_new : numpy.ndarray
+        Intensities of the new rows.
+    - state : dict
+        Keys 'offset', 'rows' (total rows read) and 'tail_hash' for the next
+        call, and 'appended', which is False if the rows were read from the
+        start of the file and replace any previously read data.
+
+    Raises:
+    - SystemExit
+        If the file is not found or the file format is incorrect.
+    """
+    try:
+        with open(file_path, "rb") as file:
+            file.seek(0, 2)
+            size = file.tell()
+
+            offset, rows, appended = 0, 0, False
+            if state is not None and state["offset"] <= size:
+                if _tail_hash(file, state["offset"]) == state["tail_hash"]:
+                    offset, rows, appended = state["offset"], state["rows"], True
+            if state is not None and not appended:
+                print(f"{file_path} was rewritten, reading it from the start.")
+
+            file.seek(offset)
+            chunk = file.read(size - offset)
+            chunk = chunk[: chunk.rfind(b"\n") + 1]
+
+            # First two columns of each line, as in `read_data`
+            column1, column2 = [], []
+            for line in chunk.decode().splitlines():
+                parts = line.split()
+                column1.append(float(parts[0]))
+                column2.append(float(parts[1]))
+            values = np.array([column1, column2], dtype=np.float64).T
+
+            offset += len(chunk)
+            tail_hash = _tail_hash(file, offset)
+    except FileNotFoundError:
+        print(f"Error: The file {file_path} was not found.")
+        sys.exit(1)
+    except (IndexError, ValueError):
+        print(f"Error: Incorrect file format in {file_path}.")
+        sys.exit(1)
+
+    state = {
+        "offset": offset,
+        "rows": rows + len(values),
+        "tail_hash": tail_hash,
+        "appended": appended,
+    }
+    return values[:, 0].astype(precision), values[:, 1].astype(precision), state
+
+
+def append_flashes(file_path, x_new, I_new, start_row):
+    """
+    Store flashes in a binary file of float64 (x, I) rows, starting at a row.
+
+    Writing starts at `start_row`, so rows left behind by an interrupted update
+    are overwritten, and only the new rows are written.
+
+    Parameters:
+    - file_path : str
+        Path to the binary file, created if it does not exist.
+    - x_new : numpy.ndarray
+        Flash locations to store.
+    - I_new : numpy.ndarray
+        Intensities to store.
+    - start_row : int
+        Row at which to write, e.g. the number of rows already stored, or 0 to
+        replace the contents of the file.
+    """
+    rows = np.column_stack([x_new, I_new]).astype(np.float64)
+    mode = "r+b" if os.path.exists(file_path) else "wb"
+    with open(file_path, mode) as file:
+        file.seek(start_row * rows.itemsize * 2)
+        rows.tofile(file)
+        file.truncate()
+
+
+def read_flashes(file_path, rows, precision="float32"):
+    """
+    Read the first `rows` flashes stored with `append_flashes`.
+
+    Parameters:
+    - file_path : str
+        Path to the binary file.
+    - rows : int
+        Number of rows to read.
+    - precision : str, optional
+        Floating point precision of the arrays, 'float32' or 'float64'.
+        Default is 'float32'.
+
+    Returns:
+    - x_observed : numpy.ndarray
+        Stored flash locations.
+    - I_observed : numpy.ndarray
+        Stored intensities.
+    """
+    values = np.fromfile(file_path, dtype=np.float64, count=2 * rows).reshape(-1, 2)
+    return values[:, 0].astype(precision), values[:, 1].astype(precision)
+
+
 def read_config(input_file):
     """
     Read configuration settings from a file and return model and sampling parameters.
@@ -111,3 +250,59 @@ def read_config(input_file):
     seed = config.getint("General", "seed", fallback=12042000)
 
     return model_params, sampling_params, seed
+
+
+def read_precision(input_file):
+    """
+    Read the floating point precision setting from a configuration file.
+
+    The precision applies to the data arrays, the compiled model (Theano's
+    floatX) and the stored traces.
+
+    Parameters:
+    - input_file : str
+        Path to the configuration file.
+
+    Returns:
+    - precision : str
+        Either 'float32' or 'float64', read from 'precision' in the 'General'
+        section with a fallback of 'float64'.
+
+    Raises:
+    - SystemExit
+        If the precision is not 'float32' or 'float64'.
+    """
+    config = cfg.ConfigParser()
+    config.read(input_file)
+
+    precision = config.get("General", "precision", fallback="float64")
+    if precision not in ("float32", "float64"):
+        print(f"Error: Unsupported precision {precision} in {input_file}.")
+        sys.exit(1)
+
+    return precision
+
+
+def pack_sites(sites):
+    """
+    Pack the observations of several sites into flat arrays with offsets.
+
+    Parameters:
+    - sites : list of tuple
+        One (x_observed, I_observed) pair per site, e.g. as returned by
+        `read_and_prepare_data`. Sites may have different numbers of flashes.
+
+    Returns:
+    - x_flat : numpy.ndarray
+        Flash locations of all sites, concatenated.
+    - I_flat : numpy.ndarray
+        Intensities of all sites, concatenated.
+    - offsets : numpy.ndarray
+        Array of length S + 1 such that site s occupies
+        x_flat[offsets[s]:offsets[s + 1]].
+    """
+    lengths = [len(x_observed) for x_observed, _ in sites]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    x_flat = np.concatenate([x_observed for x_observed, _ in sites])
+    I_flat = np.concatenate([I_observed for _, I_observed in sites])
+    return x_flat, I_flat, offsets
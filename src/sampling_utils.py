@@ -1,6 +1,27 @@
 import pymc3 as pm
+import theano
 import theano.tensor as tt
 import numpy as np
+import arviz as az
+from scipy import stats
+from pymc3.distributions.dist_math import normal_lcdf
+from pymc3.step_methods.hmc.quadpotential import QuadPotentialDiagAdapt
+from pymc3.theanof import inputvars
+from pymc3.util import is_transformed_name, get_untransformed_name
+
+from likelihood_utils import PARETO_ALPHA, PARETO_M, collapsed_I0_moments
+from monitor_utils import ConvergenceMonitor
+
+
+def set_precision(precision):
+    """
+    Sets the floating point precision used when compiling models.
+
+    Parameters:
+    - precision: Either 'float32' or 'float64', applied to Theano's floatX.
+      The likelihood sums over the flashes are always accumulated in float64.
+    """
+    theano.config.floatX = precision
 
 
 def define_model_x(x_observed, a, b, c, d):
@@ -9,7 +30,8 @@ def define_model_x(x_observed, a, b, c, d):
 
     Parameters:
     - x_observed: Observed data for x (flash locations).
-    - a, b: Lower and upper bounds for the uniform prior of alpha.
+    - a, b: Lower and upper bounds for the uniform prior of the shared alpha
+      location.
     - c, d: Lower and upper bounds for the uniform prior of beta.
 
     Returns:
@@ -20,8 +42,10 @@ def define_model_x(x_observed, a, b, c, d):
         alpha = pm.Uniform("alpha", lower=a, upper=b)
         beta = pm.Uniform("beta", lower=c, upper=d)
 
-        # Likelihood
-        pm.Cauchy("x_likelihood", alpha=alpha, beta=beta, observed=x_observed)
+        # Likelihood, summed over the flashes in double precision
+        pm.Cauchy(
+            "x_likelihood", alpha=alpha, beta=beta, observed=x_observed, dtype="float64"
+        )
     return model
 
 
@@ -43,17 +67,212 @@ def define_model_xi(x_observed, I_observed, a, b, c, d):
         # Priors
         alpha = pm.Uniform("alpha", lower=a, upper=b)
         beta = pm.Uniform("beta", lower=c, upper=d)
-        I0 = pm.Pareto("I0", alpha=2, m=0.01)
+        I0 = pm.Pareto("I0", alpha=PARETO_ALPHA, m=PARETO_M)
 
-        # Likelihoods
-        pm.Cauchy("x_likelihood", alpha=alpha, beta=beta, observed=x_observed)
+        # Likelihoods, summed over the flashes in double precision
+        pm.Cauchy(
+            "x_likelihood", alpha=alpha, beta=beta, observed=x_observed, dtype="float64"
+        )
         d = tt.sqrt(beta**2 + (x_observed - alpha) ** 2)
         mu = tt.log(I0) - 2 * tt.log(d)
-        pm.Lognormal("I_likelihood", mu=mu, sigma=1, observed=I_observed)
+        pm.Lognormal(
+            "I_likelihood", mu=mu, sigma=1, observed=I_observed, dtype="float64"
+        )
+    return model
+
+
+def define_model_xi_collapsed(x_observed, I_observed, a, b, c, d):
+    """
+    Defines the `define_model_xi` model with I0 analytically marginalised out.
+
+    Writing y_k = log(I_k) + log(d_k^2), the lognormal likelihood is Gaussian
+    in log(I0) and the Pareto prior is exponential in log(I0), so the integral
+    over I0 reduces to a Gaussian normal-CDF term. Only alpha and beta are
+    sampled; I0 is recovered afterwards with `sample_I0`.
+
+    Parameters:
+    - x_observed: Observed data for x (flash locations).
+    - I_observed: Observed data for I (intensities).
+    - a, b: Lower and upper bounds for the uniform prior of alpha.
+    - c, d: Lower and upper bounds for the uniform prior of beta.
+
+    Returns:
+    - PyMC3 model object.
+    """
+    n = len(x_observed)
+    # Double precision so the sums over flashes accumulate in float64
+    log_I = np.log(I_observed.astype(np.float64))
+
+    # Python floats so Theano keeps the graph at floatX
+    log_m = float(np.log(PARETO_M))
+    sqrt_n = float(np.sqrt(n))
+
+    with pm.Model() as model:
+        # Priors
+        alpha = pm.Uniform("alpha", lower=a, upper=b)
+        beta = pm.Uniform("beta", lower=c, upper=d)
+
+        # Likelihoods, summed over the flashes in double precision
+        pm.Cauchy(
+            "x_likelihood", alpha=alpha, beta=beta, observed=x_observed, dtype="float64"
+        )
+        y = log_I + tt.log(beta**2 + (x_observed - alpha) ** 2)
+        y_mean = tt.mean(y)
+        loc = y_mean - PARETO_ALPHA / n
+        pm.Potential(
+            "I_marginal_likelihood",
+            -tt.sum((y - y_mean) ** 2) / 2
+            - PARETO_ALPHA * y_mean
+            + normal_lcdf(0, 1, (loc - log_m) * sqrt_n),
+        )
     return model
 
 
-def sample_model(model, seed, draws, tune, chains, target_accept):
+def define_model_hierarchical(x_flat, I_flat, offsets, a, b, c, d):
+    """
+    Defines a hierarchical `define_model_xi` model fitting many sites at once.
+
+    Each site has its own alpha, beta and I0, drawn from shared hyperpriors:
+    alpha is normal around a common location, log(beta) is normal around a
+    common scale (both non-centred) and I0 is Pareto with a common tail
+    index. Per-site alphas are therefore not confined to [a, b], only their
+    common location is. The likelihood of every flash of
+    every site is evaluated in a single vectorised term by indexing the site
+    parameters with the site of each flash.
+
+    Parameters:
+    - x_flat: Flash locations of all sites, concatenated (see `pack_sites`).
+    - I_flat: Intensities of all sites, concatenated.
+    - offsets: Array of length S + 1 of segment offsets into x_flat and I_flat.
+    - a, b: Lower and upper bounds for the uniform prior of alpha.
+    - c, d: Lower and upper bounds for the uniform prior of the shared beta scale.
+
+    Returns:
+    - PyMC3 model object with per-site variables along the 'site' dimension.
+    """
+    n_sites = len(offsets) - 1
+    site_index = np.repeat(np.arange(n_sites), np.diff(offsets))
+
+    with pm.Model(coords={"site": np.arange(n_sites)}) as model:
+        # Hyperpriors
+        alpha_mu = pm.Uniform("alpha_mu", lower=a, upper=b)
+        alpha_sigma = pm.HalfNormal("alpha_sigma", sigma=(b - a) / 4)
+        beta_scale = pm.Uniform("beta_scale", lower=c, upper=d)
+        beta_sigma = pm.HalfNormal("beta_sigma", sigma=1)
+        I0_alpha = pm.Exponential("I0_alpha", lam=1 / PARETO_ALPHA)
+
+        # Per-site priors
+        alpha_offset = pm.Normal("alpha_offset", mu=0, sigma=1, dims="site")
+        alpha = pm.Deterministic(
+            "alpha", alpha_mu + alpha_sigma * alpha_offset, dims="site"
+        )
+        beta_offset = pm.Normal("beta_offset", mu=0, sigma=1, dims="site")
+        beta = pm.Deterministic(
+            "beta", beta_scale * tt.exp(beta_sigma * beta_offset), dims="site"
+        )
+        I0 = pm.Pareto("I0", alpha=I0_alpha, m=PARETO_M, dims="site")
+
+        # Likelihoods, one pass over the flashes of all sites, summed in
+        # double precision
+        alpha_flash = alpha[site_index]
+        beta_flash = beta[site_index]
+        pm.Cauchy(
+            "x_likelihood",
+            alpha=alpha_flash,
+            beta=beta_flash,
+            observed=x_flat,
+            dtype="float64",
+        )
+        d = tt.sqrt(beta_flash**2 + (x_flat - alpha_flash) ** 2)
+        mu = tt.log(I0[site_index]) - 2 * tt.log(d)
+        pm.Lognormal("I_likelihood", mu=mu, sigma=1, observed=I_flat, dtype="float64")
+    return model
+
+
+def sample_I0(trace, x_observed, I_observed, seed):
+    """
+    Draws I0 exactly from its conditional posterior for each (alpha, beta) draw.
+
+    Given (alpha, beta), log(I0) is normal with mean and standard deviation from
+    `collapsed_I0_moments`, truncated below at log(m) by the Pareto prior.
+
+    Parameters:
+    - trace: An ArviZ InferenceData object from `define_model_xi_collapsed`.
+    - x_observed: Observed data for x (flash locations).
+    - I_observed: Observed data for I (intensities).
+    - seed: The random seed to use for reproducibility.
+
+    Returns:
+    - An ArviZ InferenceData object with alpha, beta and I0 in the posterior,
+      matching the output of sampling `define_model_xi`.
+    """
+    alpha = trace.posterior["alpha"].values
+    beta = trace.posterior["beta"].values
+    _, _, loc, scale = collapsed_I0_moments(alpha, beta, x_observed, I_observed)
+
+    lower = (np.log(PARETO_M) - loc) / scale
+    log_I0 = stats.truncnorm.rvs(
+        lower,
+        np.inf,
+        loc=loc,
+        scale=scale,
+        size=loc.shape,
+        random_state=np.random.RandomState(seed),
+    )
+
+    posterior = trace.posterior.assign(
+        I0=(("chain", "draw"), np.exp(log_I0).astype(alpha.dtype))
+    )
+    groups = {"posterior": posterior}
+    if "sample_stats" in trace.groups():
+        groups["sample_stats"] = trace.sample_stats
+    return az.InferenceData(**groups)
+
+
+def _cast_trace(trace, precision):
+    """
+    Cast the posterior and sampler statistics of a trace to `precision`.
+    """
+    if precision is not None:
+        # Cast floating point values only, leaving flags such as `diverging`
+        for group in ("posterior", "sample_stats"):
+            dataset = getattr(trace, group)
+            dataset = dataset.map(
+                lambda v: v.astype(precision) if v.dtype.kind == "f" else v,
+                keep_attrs=True,
+            )
+            setattr(trace, group, dataset)
+    return trace
+
+
+def compile_logp_dlogp(model):
+    """
+    Compiles the log density and gradient function NUTS uses for a model.
+
+    Passing the result to `sample_model` lets several runs of the same model
+    share one Theano compilation.
+
+    Parameters:
+    - model: A PyMC3 model object.
+
+    Returns:
+    - The compiled `ValueGradFunction` over the model's continuous variables.
+    """
+    return model.logp_dlogp_function(inputvars(model.cont_vars))
+
+
+def sample_model(
+    model,
+    seed,
+    draws,
+    tune,
+    chains,
+    target_accept,
+    cores=None,
+    precision=None,
+    callback=None,
+    logp_dlogp_func=None,
+):
     """
     Samples from a given PyMC3 model using the No-U-Turn Sampler (NUTS).
 
@@ -64,6 +283,12 @@ def sample_model(model, seed, draws, tune, chains, target_accept):
     - tune: The number of iterations to tune the sampler.
     - chains: The number of independent chains to run.
     - target_accept: The target acceptance probability for the NUTS sampler.
+    - cores: The number of chains to run in parallel. Defaults to PyMC3's choice.
+    - precision: Floating point precision of the stored posterior and sampler
+      statistics, 'float32' or 'float64'. Defaults to the sampled precision.
+    - callback: Function called after every draw, e.g. a `ConvergenceMonitor`.
+    - logp_dlogp_func: A compiled log density and gradient of the model, from
+      `compile_logp_dlogp`, to reuse instead of compiling a new one.
 
     Returns:
     - A PyMC3 Trace object containing the samples.
@@ -71,12 +296,145 @@ def sample_model(model, seed, draws, tune, chains, target_accept):
     np.random.seed(seed)
 
     with model:
-        step = pm.NUTS(target_accept=target_accept)
+        step = pm.NUTS(target_accept=target_accept, logp_dlogp_func=logp_dlogp_func)
         trace = pm.sample(
             draws=draws,
             tune=tune,
             chains=chains,
+            cores=cores,
             step=step,
+            callback=callback,
             return_inferencedata=True,
         )
-    return trace
+
+    return _cast_trace(trace, precision)
+
+
+def warm_start(model, trace, chains, weight=100):
+    """
+    Initial points, mass matrix and step size for a model from a previous trace.
+
+    The previous draws are mapped to the model's sampling space with the
+    transforms of its free variables. Every chain starts at the last draw of a
+    previous chain, and the diagonal mass matrix is initialised from the
+    pooled posterior mean and variance.
+
+    Parameters:
+    - model: A PyMC3 model object with the same variables as the trace, e.g.
+      the same model built on data with new flashes appended.
+    - trace: The previous trace, with a 'step_size' sampler statistic.
+    - chains: The number of chains to initialise.
+    - weight: The number of draws the previous mass matrix estimate is worth
+      when it is adapted further.
+
+    Returns:
+    - start: A list of start points, one per chain.
+    - potential: A `QuadPotentialDiagAdapt` for `pm.NUTS`.
+    - step_scale: The step scale for `pm.NUTS` giving the previous step size.
+    """
+    index = np.arange(chains) % trace.posterior.sizes["chain"]
+    start = [{} for _ in range(chains)]
+    means, variances = [], []
+
+    for var in model.cont_vars:
+        if is_transformed_name(var.name):
+            name = get_untransformed_name(var.name)
+            transform = model.named_vars[name].transformation
+            values = transform.forward_val(trace.posterior[name].values)
+        else:
+            values = trace.posterior[var.name].values
+
+        for point, value in zip(start, values[index, -1]):
+            point[var.name] = value
+        flat = values.reshape(values.shape[0] * values.shape[1], -1)
+        means.append(flat.mean(axis=0))
+        variances.append(flat.var(axis=0))
+
+    potential = QuadPotentialDiagAdapt(
+        model.ndim, np.concatenate(means), np.concatenate(variances), weight
+    )
+    step_size = trace.sample_stats["step_size"].values[index, -1].mean()
+    return start, potential, step_size * model.ndim**0.25
+
+
+def sample_model_incremental(
+    model,
+    trace,
+    seed,
+    draws,
+    tune,
+    chains,
+    target_accept,
+    cores=None,
+    precision=None,
+):
+    """
+    Samples a model warm-started from a previous trace, e.g. after new flashes
+    were appended to the data.
+
+    The chains start from the previous posterior with its adaptation (see
+    `warm_start`), so only a short re-tune is needed instead of the full
+    tuning of `sample_model`.
+
+    Parameters:
+    - model: A PyMC3 model object to be sampled from.
+    - trace: The previous trace of the same model.
+    - seed: The random seed to use for reproducibility.
+    - draws: The number of samples to draw from the posterior distribution.
+    - tune: The number of re-tuning iterations, e.g. 100.
+    - chains: The number of independent chains to run.
+    - target_accept: The target acceptance probability for the NUTS sampler.
+    - cores: The number of chains to run in parallel. Defaults to PyMC3's choice.
+    - precision: Floating point precision of the stored posterior and sampler
+      statistics, as in `sample_model`.
+
+    Returns:
+    - A PyMC3 Trace object containing the samples.
+    """
+    np.random.seed(seed)
+
+    start, potential, step_scale = warm_start(model, trace, chains)
+    with model:
+        step = pm.NUTS(
+            target_accept=target_accept, potential=potential, step_scale=step_scale
+        )
+        trace = pm.sample(
+            draws=draws,
+            tune=tune,
+            chains=chains,
+            cores=cores,
+            step=step,
+            start=start,
+            return_inferencedata=True,
+        )
+
+    return _cast_trace(trace, precision)
+
+
+def sample_model_monitored(model, seed, max_restarts=1, monitor_kwargs=None, **kwargs):
+    """
+    Samples a model under a `ConvergenceMonitor`, restarting runs that go bad.
+
+    PyMC3 cannot replace individual chains mid-run, so when the monitor aborts
+    sampling the whole run is restarted with a new seed, up to `max_restarts`
+    times.
+
+    Parameters:
+    - model: A PyMC3 model object to be sampled from.
+    - seed: The random seed of the first run, incremented on each restart.
+    - max_restarts: The number of restarts allowed after an abort.
+    - monitor_kwargs: Keyword arguments for `ConvergenceMonitor`.
+    - **kwargs: Sampling parameters passed to `sample_model`.
+
+    Returns:
+    - trace: The trace of the last run.
+    - monitor: The `ConvergenceMonitor` of the last run, whose `aborted` flag
+      shows whether the last run was also stopped early.
+    """
+    for attempt in range(max_restarts + 1):
+        monitor = ConvergenceMonitor(**(monitor_kwargs or {}))
+        trace = sample_model(model, seed + attempt, callback=monitor, **kwargs)
+        if not monitor.aborted:
+            break
+        print(f"Run {attempt + 1} aborted: {monitor.reason}")
+    return trace, monitor
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import uuid
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import Future, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from importance_utils import importance_sample
+from hmc_utils import sample_nuts
+
+# Per-request sampling defaults, much smaller than the batch settings in the
+# configuration file. Importance sampling (the default method) answers in tens
+# of milliseconds, NUTS with these settings in one to two seconds.
+SERVICE_SAMPLING_PARAMS = {
+    "draws": 500,
+    "tune": 200,
+    "chains": 4,
+    "target_accept": 0.8,
+}
+
+METHODS = ("importance", "nuts")
+
+
+class ServiceBusy(Exception):
+    """
+    Raised when the request queue of the inference service is full.
+    """
+
+
+def _summarise(trace):
+    """
+    Posterior mean, sd and 94% interval of each variable, computed directly
+    with NumPy to keep per-request latency low.
+    """
+    summary = {}
+    for var_name, values in trace.posterior.data_vars.items():
+        values = values.values.ravel()
+        low, high = np.quantile(values, [0.03, 0.97])
+        summary[var_name] = {
+            "mean": float(np.mean(values)),
+            "sd": float(np.std(values)),
+            "q3%": float(low),
+            "q97%": float(high),
+        }
+    return summary
+
+
+def _parse_job(job):
+    """
+    Validate a request and convert its data to arrays.
+
+    Checks the data, the method, the prior bounds (numbers with a < b and
+    0 <= c < d) and the sampling parameters (positive integer draws and
+    chains, non-negative integer tune, 0 < target_accept < 1).
+
+    Raises:
+    - KeyError, TypeError or ValueError
+        If the request is malformed.
+    """
+    if not isinstance(job, dict):
+        raise TypeError("Request must be a JSON object")
+    x_observed = np.asarray(job["x"], dtype=np.float64)
+    if x_observed.ndim != 1 or len(x_observed) == 0:
+        raise ValueError("'x' must be a non-empty list of numbers")
+    I_observed = job.get("I")
+    if I_observed is not None:
+        I_observed = np.asarray(I_observed, dtype=np.float64)
+        if I_observed.shape != x_observed.shape:
+            raise ValueError("'I' must have the same length as 'x'")
+    method = job.get("method", "importance")
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}")
+    if not np.isfinite(x_observed).all() or (
+        I_observed is not None and not np.isfinite(I_observed).all()
+    ):
+        raise ValueError("'x' and 'I' must be finite")
+
+    model_params = job["model_params"]
+    if set(model_params) != {"a", "b", "c", "d"}:
+        raise ValueError("'model_params' must have exactly the keys a, b, c and d")
+    if not all(_is_number(value) for value in model_params.values()):
+        raise ValueError("Model parameters must be finite numbers")
+    if not (
+        model_params["a"] < model_params["b"] and model_params["c"] < model_params["d"]
+    ):
+        raise ValueError("Prior bounds must satisfy a < b and c < d")
+    if model_params["c"] < 0:
+        raise ValueError("The lower bound c of beta must not be negative")
+
+    sampling_params = job["sampling_params"]
+    unknown = set(sampling_params) - set(SERVICE_SAMPLING_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown sampling parameters: {sorted(unknown)}")
+    for key in ("draws", "tune", "chains"):
+        value = sampling_params.get(key, 1)
+        if not _is_int(value) or value < (0 if key == "tune" else 1):
+            raise ValueError(f"'{key}' must be a positive integer")
+    target_accept = sampling_params.get("target_accept", 0.8)
+    if not _is_number(target_accept) or not 0 < target_accept < 1:
+        raise ValueError("'target_accept' must be between 0 and 1")
+
+    if "proposals" in job and (not _is_int(job["proposals"]) or job["proposals"] < 1):
+        raise ValueError("'proposals' must be a positive integer")
+    if "seed" in job and (not _is_int(job["seed"]) or job["seed"] < 0):
+        raise ValueError("'seed' must be a non-negative integer")
+    return x_observed, I_observed, method
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value):
+    return (
+        isinstance(value, (int, float))
+        and not isinstance(value, bool)
+        and np.isfinite(value)
+    )
+
+
+def run_job(job, trace_dir=None):
+    """
+    Run a single inference request.
+
+    Parameters:
+    - job : dict
+        Request with keys 'x' (flash locations) and optionally 'I'
+        (intensities), 'method' ('importance' or 'nuts'), 'model_params',
+        'sampling_params', 'proposals' (importance sampling only), 'seed' and
+        'trace' (whether to write a trace file).
+    - trace_dir : str, optional
+        Directory for trace files.
+
+    Returns:
+    - result : dict
+        'summary' with the posterior summaries, 'diagnostics', 'runtime' and,
+        if requested, 'trace_file'. If the request fails, 'error' holds the
+        message instead and 'status' is 400 for a malformed request or 500
+        for a failure during inference.
+    """
+    start = time.perf_counter()
+    try:
+        x_observed, I_observed, method = _parse_job(job)
+    except (KeyError, TypeError, ValueError) as error:
+        result = {"error": f"{type(error).__name__}: {error}", "status": 400}
+        result["runtime"] = time.perf_counter() - start
+        return result
+
+    try:
+        model_params = job["model_params"]
+        seed = job.get("seed", 0)
+
+        if method == "nuts":
+            trace = sample_nuts(
+                x_observed, I_observed, seed, **job["sampling_params"], **model_params
+            )
+            diagnostics = {
+                "divergences": int(trace.sample_stats["diverging"].values.sum())
+            }
+        else:
+            trace = importance_sample(
+                x_observed,
+                I_observed,
+                seed=seed,
+                proposals=job.get("proposals", 50000),
+                draws=job["sampling_params"].get("draws", 10000),
+                collapsed=True,
+                **model_params,
+            )
+            diagnostics = {
+                "ess": float(trace.posterior.attrs["importance_ess"]),
+                "pareto_k": float(trace.posterior.attrs["pareto_k"]),
+            }
+
+        result = {"summary": _summarise(trace), "diagnostics": diagnostics}
+        if job.get("trace") and trace_dir is not None:
+            path = os.path.join(trace_dir, f"{uuid.uuid4().hex}.nc")
+            trace.to_netcdf(path)
+            result["trace_file"] = path
+    except Exception as error:
+        result = {"error": f"{type(error).__name__}: {error}", "status": 500}
+
+    result["runtime"] = time.perf_counter() - start
+    return result
+
+
+def run_batch(jobs, trace_dir=None):
+    """
+    Run a batch of requests in one worker task.
+    """
+    return [run_job(job, trace_dir) for job in jobs]
+
+
+def _warm_worker():
+    """
+    Worker initialiser: run a tiny job so imports and code paths are warm.
+    """
+    x_observed = np.array([-1.0, 0.0, 1.0])
+    run_job(
+        {
+            "x": x_observed,
+            "model_params": dict(a=-5, b=5, c=0, d=8),
+            "sampling_params": SERVICE_SAMPLING_PARAMS,
+            "seed": 0,
+        }
+    )
+
+
+class InferenceService:
+    """
+    Pool of warm workers running lighthouse inference requests.
+
+    Requests are put on a bounded queue; a dispatcher thread groups them into
+    batches of up to `max_batch` requests (waiting at most `batch_window`
+    seconds for a batch to fill) and hands each batch to a worker as one task.
+    At most two batches per worker are in flight, so when the workers fall
+    behind the queue fills and `submit` raises ServiceBusy.
+
+    Parameters:
+    - model_params : dict
+        Default model parameters, e.g. from `read_config`.
+    - sampling_params : dict, optional
+        Default sampling parameters. Defaults to `SERVICE_SAMPLING_PARAMS`.
+    - processes : int, optional
+        Number of worker processes. Defaults to the number of cores.
+    - max_queue : int, optional
+        Maximum number of queued requests. Default is 256.
+    - max_batch : int, optional
+        Maximum number of requests per batch. Default is 16.
+    - batch_window : float, optional
+        Maximum time in seconds to wait for a batch to fill. Default is 0.005.
+    - trace_dir : str, optional
+        Directory for trace files. Defaults to 'traces'.
+    """
+
+    def __init__(
+        self,
+        model_params,
+        sampling_params=None,
+        processes=None,
+        max_queue=256,
+        max_batch=16,
+        batch_window=0.005,
+        trace_dir="traces",
+    ):
+        self.model_params = model_params
+        self.sampling_params = sampling_params or SERVICE_SAMPLING_PARAMS
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.trace_dir = trace_dir
+        os.makedirs(trace_dir, exist_ok=True)
+
+        processes = processes or os.cpu_count()
+        self.pool = multiprocessing.Pool(processes, initializer=_warm_worker)
+        self.in_flight = threading.BoundedSemaphore(2 * processes)
+        self.requests = queue.Queue(maxsize=max_queue)
+
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, job):
+        """
+        Queue a request and return a Future for its result.
+
+        Parameters:
+        - job : dict
+            Request, see `run_job`. Missing model and sampling parameters are
+            taken from the service defaults.
+
+        Returns:
+        - concurrent.futures.Future
+            Resolves to the result dictionary of `run_job`.
+
+        Raises:
+        - ServiceBusy
+            If the request queue is full.
+        - TypeError
+            If the request is not a dictionary.
+        """
+        if not isinstance(job, dict):
+            raise TypeError("Request must be a JSON object")
+        job = dict(job)
+        job["model_params"] = {**self.model_params, **job.get("model_params", {})}
+        job["sampling_params"] = {
+            **self.sampling_params,
+            **job.get("sampling_params", {}),
+        }
+
+        future = Future()
+        try:
+            self.requests.put_nowait((job, future))
+        except queue.Full:
+            raise ServiceBusy("Request queue is full")
+        return future
+
+    def _dispatch(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            jobs = [job for job, _ in batch]
+            futures = [future for _, future in batch]
+            self.in_flight.acquire()
+            self.pool.apply_async(
+                run_batch,
+                (jobs, self.trace_dir),
+                callback=lambda results, f=futures: self._resolve(f, results),
+                error_callback=lambda error, f=futures: self._fail(f, error),
+            )
+
+    def _resolve(self, futures, results):
+        self.in_flight.release()
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+    def _fail(self, futures, error):
+        self.in_flight.release()
+        for future in futures:
+            future.set_exception(error)
+
+    def close(self):
+        """
+        Stop the worker pool.
+        """
+        self.pool.terminate()
+        self.pool.join()
+
+
+def _make_handler(service, timeout):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok", "queued": service.requests.qsize()})
+            else:
+                self._reply(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path != "/infer":
+                self._reply(404, {"error": "Not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                job = json.loads(self.rfile.read(length))
+                result = service.submit(job).result(timeout=timeout)
+            except ServiceBusy as error:
+                self._reply(503, {"error": str(error)})
+                return
+            except TimeoutError:
+                self._reply(504, {"error": "Timed out waiting for a worker"})
+                return
+            except (ValueError, KeyError, TypeError) as error:
+                self._reply(400, {"error": str(error)})
+                return
+            except Exception as error:
+                self._reply(500, {"error": f"{type(error).__name__}: {error}"})
+                return
+            self._reply(result.pop("status", 200), result)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(
+    model_params,
+    sampling_params=None,
+    host="127.0.0.1",
+    port=8000,
+    timeout=60,
+    **kwargs,
+):
+    """
+    Run the inference service over HTTP until interrupted.
+
+    Endpoints:
+    - POST /infer with a JSON request (see `run_job`) returns the posterior
+      summaries, 400 for a malformed request, 500 if inference fails, or 503
+      if the queue is full.
+    - GET /health returns the service status and queue length.
+
+    Parameters:
+    - model_params : dict
+        Default model parameters.
+    - sampling_params : dict, optional
+        Default sampling parameters. Defaults to `SERVICE_SAMPLING_PARAMS`.
+    - host : str, optional
+        Address to bind to. Default is '127.0.0.1'.
+    - port : int, optional
+        Port to listen on. Default is 8000.
+    - timeout : float, optional
+        Maximum time in seconds to wait for a result. Default is 60.
+    - **kwargs
+        Passed to `InferenceService`.
+    """
+    service = InferenceService(model_params, sampling_params, **kwargs)
+    server = ThreadingHTTPServer((host, port), _make_handler(service, timeout))
+    print(f"Serving lighthouse inference on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class KLLSketch:
+    """
+    Mergeable streaming quantile sketch (Karnin, Lang and Liberty, 2016).
+
+    Items are kept in a hierarchy of compactors. Items at level h carry a
+    weight of 2**h; when a level exceeds its capacity it is sorted and every
+    other item (with a random offset) is promoted to the next level. Level
+    capacities shrink geometrically from the top level down, so the sketch
+    holds O(k log(n / k)) items and its rank error is O(1 / k) of n. Two
+    sketches are merged by concatenating their levels and compacting, so work
+    can be split across processes.
+
+    Parameters:
+    - k : int, optional
+        Capacity of the top level, which sets the accuracy. Default is 200.
+    - seed : int or numpy.random.SeedSequence, optional
+        Seed for the random compaction offsets.
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0)]
+        self.count = 0
+
+    def _capacity(self, level):
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+
+                # An odd item out stays behind so the total weight is exact
+                odd = len(items) % 2
+                keep = items[:odd]
+                items = items[odd:]
+                offset = self.rng.integers(2)
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], items[offset::2]]
+                )
+                self.levels[level] = keep
+            level += 1
+
+    def update(self, values):
+        """
+        Add a batch of values to the sketch.
+
+        Parameters:
+        - values : array_like
+            Values to add.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other):
+        """
+        Merge another sketch into this one.
+
+        Parameters:
+        - other : KLLSketch
+            The sketch to merge. It is left unchanged.
+
+        Returns:
+        - KLLSketch
+            This sketch, for chaining.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+        return self
+
+    def copy(self):
+        """
+        Return an independent copy of the sketch.
+        """
+        sketch = KLLSketch(self.k)
+        sketch.rng = np.random.default_rng(self.rng.integers(2**63))
+        sketch.levels = [items.copy() for items in self.levels]
+        sketch.count = self.count
+        return sketch
+
+    def quantile(self, q):
+        """
+        Estimate quantiles of the values seen so far.
+
+        Parameters:
+        - q : float or array_like
+            Quantiles to compute, between 0 and 1.
+
+        Returns:
+        - float or numpy.ndarray
+            The estimated quantiles.
+        """
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(level), 2.0**h) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order])
+        index = np.searchsorted(cumulative, np.asarray(q) * cumulative[-1])
+        return items[order][np.minimum(index, len(items) - 1)]
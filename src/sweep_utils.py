@@ -0,0 +1,333 @@
+import os
+import time
+import itertools
+import arviz as az
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from sampling_utils import (
+    define_model_x,
+    define_model_xi,
+    compile_logp_dlogp,
+    sample_model,
+)
+
+
+MODEL_KEYS = ("a", "b", "c", "d")
+SAMPLING_KEYS = ("draws", "tune", "chains", "target_accept")
+
+# Models and their compiled log density and gradient already built in this
+# process, keyed by model type and prior bounds
+_MODEL_CACHE = {}
+
+
+def expand_grid(grid):
+    """
+    Expand a grid of parameter values into a list of configuration overrides.
+
+    Parameters:
+    - grid : dict
+        Dictionary mapping parameter names to a list of values to try,
+        e.g. {"draws": [1000, 5000], "target_accept": [0.8, 0.9]}.
+
+    Returns:
+    - overrides : list of dict
+        One dictionary per combination of the grid values.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def apply_overrides(model_params, sampling_params, seed, overrides):
+    """
+    Merge a dictionary of overrides into the model and sampling parameters.
+
+    Parameters:
+    - model_params : dict
+        Base model parameters with keys 'a', 'b', 'c' and 'd'.
+    - sampling_params : dict
+        Base sampling parameters with keys 'draws', 'tune', 'chains' and
+        'target_accept'.
+    - seed : int
+        Base random seed.
+    - overrides : dict
+        Values replacing the base settings. Keys must be model parameters,
+        sampling parameters or 'seed'.
+
+    Returns:
+    - model_params : dict
+        Model parameters with the overrides applied.
+    - sampling_params : dict
+        Sampling parameters with the overrides applied.
+    - seed : int
+        Random seed with the override applied.
+
+    Raises:
+    - ValueError
+        If an override key is not a known parameter.
+    """
+    unknown = set(overrides) - set(MODEL_KEYS) - set(SAMPLING_KEYS) - {"seed"}
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+
+    model_params = dict(model_params)
+    sampling_params = dict(sampling_params)
+    for key, value in overrides.items():
+        if key in MODEL_KEYS:
+            model_params[key] = value
+        elif key in SAMPLING_KEYS:
+            sampling_params[key] = value
+    seed = overrides.get("seed", seed)
+
+    return model_params, sampling_params, seed
+
+
+def get_model(x_observed, I_observed, model_params):
+    """
+    Return the model for the given prior bounds and its compiled log density
+    and gradient, building both on first use.
+
+    Models are cached per process, so configurations that only differ in their
+    sampling parameters reuse the same Theano compilation.
+
+    Parameters:
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities. If None, the flash location model is used.
+    - model_params : dict
+        Model parameters with keys 'a', 'b', 'c' and 'd'.
+
+    Returns:
+    - model : PyMC3 model object.
+    - logp_dlogp_func : The compiled function, see `compile_logp_dlogp`.
+    """
+    kind = "x" if I_observed is None else "xi"
+    key = (kind, tuple(model_params[k] for k in MODEL_KEYS))
+    if key not in _MODEL_CACHE:
+        if I_observed is None:
+            model = define_model_x(x_observed, **model_params)
+        else:
+            model = define_model_xi(x_observed, I_observed, **model_params)
+        _MODEL_CACHE[key] = (model, compile_logp_dlogp(model))
+    return _MODEL_CACHE[key]
+
+
+def summarise_run(trace, runtime):
+    """
+    Summarise a single sampling run as a flat dictionary.
+
+    Parameters:
+    - trace : arviz.InferenceData
+        The trace returned by `sample_model`.
+    - runtime : float
+        Wall-clock sampling time in seconds.
+
+    Returns:
+    - row : dict
+        Runtime, minimum bulk ESS, ESS per second, number of divergences,
+        maximum r_hat and the posterior mean, sd and HDI bounds of each
+        variable.
+    """
+    summary = az.summary(trace)
+    min_ess = summary["ess_bulk"].min()
+
+    row = {
+        "runtime": runtime,
+        "ess_bulk_min": min_ess,
+        "ess_per_s": min_ess / runtime,
+        "divergences": int(trace.sample_stats["diverging"].values.sum()),
+        "r_hat_max": summary["r_hat"].max(),
+    }
+    for var_name, stats in summary.iterrows():
+        row[f"{var_name}_mean"] = stats["mean"]
+        row[f"{var_name}_sd"] = stats["sd"]
+        row[f"{var_name}_hdi_3%"] = stats["hdi_3%"]
+        row[f"{var_name}_hdi_97%"] = stats["hdi_97%"]
+
+    return row
+
+
+def run_config(index, x_observed, I_observed, model_params, sampling_params, seed):
+    """
+    Sample a single sweep configuration and summarise the result.
+
+    Chains are run sequentially (``cores=1``) as the sweep itself provides the
+    parallelism across configurations. A configuration that fails is recorded
+    with its error message instead of aborting the sweep.
+
+    Parameters:
+    - index : int
+        Position of the configuration in the sweep.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities. If None, the flash location model is used.
+    - model_params : dict
+        Model parameters with keys 'a', 'b', 'c' and 'd'.
+    - sampling_params : dict
+        Sampling parameters passed to `sample_model`.
+    - seed : int
+        The random seed to use for reproducibility.
+
+    Returns:
+    - row : dict
+        The configuration followed by the summary from `summarise_run` and an
+        'error' entry, which is None unless the configuration failed.
+    """
+    row = {"config": index, "seed": seed, **model_params, **sampling_params}
+    start = time.perf_counter()
+    try:
+        model, logp_dlogp_func = get_model(x_observed, I_observed, model_params)
+        trace = sample_model(
+            model, seed, cores=1, logp_dlogp_func=logp_dlogp_func, **sampling_params
+        )
+        row.update(summarise_run(trace, time.perf_counter() - start))
+        row["error"] = None
+    except Exception as error:
+        print(f"Configuration {index} failed: {type(error).__name__}: {error}")
+        row["runtime"] = time.perf_counter() - start
+        row["error"] = f"{type(error).__name__}: {error}"
+    return row
+
+
+def run_group(indices, x_observed, I_observed, configs):
+    """
+    Run several sweep configurations sharing the same prior bounds in one
+    worker, so the model is compiled once for all of them.
+
+    Parameters:
+    - indices : list of int
+        Positions of the configurations in the sweep.
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities.
+    - configs : list of tuple
+        The (model_params, sampling_params, seed) of each configuration.
+
+    Returns:
+    - rows : list of dict
+        The result of `run_config` for each configuration.
+    """
+    return [
+        run_config(index, x_observed, I_observed, *config)
+        for index, config in zip(indices, configs)
+    ]
+
+
+def parameter_sweep(
+    x_observed,
+    I_observed,
+    overrides,
+    model_params,
+    sampling_params,
+    seed,
+    cpu_budget=None,
+):
+    """
+    Run a sweep over sampler and prior settings across a pool of workers.
+
+    Each entry of `overrides` is applied on top of the base parameters (as read
+    by `read_config`) and sampled in its own worker process. The number of
+    workers is set by the CPU budget and each worker runs its chains
+    sequentially, so at most `cpu_budget` cores are busy at once.
+    Configurations with the same prior bounds are submitted together in
+    batches, one batch per task, so each batch compiles its model only once.
+    Large groups are split into batches so that all workers stay busy.
+
+    Parameters:
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities. If None, `define_model_x` is swept, otherwise
+        `define_model_xi`.
+    - overrides : list of dict or dict
+        Configurations to run. A dictionary of lists is expanded with
+        `expand_grid`.
+    - model_params : dict
+        Base model parameters.
+    - sampling_params : dict
+        Base sampling parameters.
+    - seed : int
+        Base random seed.
+    - cpu_budget : int, optional
+        Maximum number of cores to use. Defaults to all available cores.
+
+    Returns:
+    - results : pandas.DataFrame
+        One row per configuration with its settings, runtime, ESS/s,
+        divergences and posterior summaries, and an 'error' column holding
+        the message of any configuration that failed.
+    """
+    if isinstance(overrides, dict):
+        overrides = expand_grid(overrides)
+
+    configs = [
+        apply_overrides(model_params, sampling_params, seed, override)
+        for override in overrides
+    ]
+
+    cpu_budget = cpu_budget or os.cpu_count()
+    max_workers = max(1, min(cpu_budget, len(configs)))
+    print(f"Running {len(configs)} configurations on {max_workers} workers")
+
+    # Group configurations sharing a model, splitting each group into about
+    # its share of the workers
+    groups = {}
+    for i, (config_model_params, _, _) in enumerate(configs):
+        key = tuple(config_model_params[k] for k in MODEL_KEYS)
+        groups.setdefault(key, []).append(i)
+    batches = []
+    for indices in groups.values():
+        n_batches = max(1, round(len(indices) * max_workers / len(configs)))
+        batches += [b.tolist() for b in np.array_split(indices, n_batches)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                run_group,
+                batch,
+                x_observed,
+                I_observed,
+                [configs[i] for i in batch],
+            )
+            for batch in batches
+        ]
+        rows = [row for future in futures for row in future.result()]
+
+    results = pd.DataFrame(rows).sort_values("config").set_index("config")
+    return results
+
+
+def cheapest_config(results, min_ess=400, max_divergences=0, max_r_hat=1.01):
+    """
+    Select the fastest configuration that meets the accuracy targets.
+
+    Parameters:
+    - results : pandas.DataFrame
+        Output of `parameter_sweep`.
+    - min_ess : float, optional
+        Minimum bulk ESS required across variables. Default is 400.
+    - max_divergences : int, optional
+        Maximum number of divergent transitions allowed. Default is 0.
+    - max_r_hat : float, optional
+        Maximum r_hat allowed across variables. Default is 1.01.
+
+    Returns:
+    - best : pandas.Series or None
+        The row of the cheapest passing configuration, or None if no
+        configuration meets the targets.
+    """
+    results = results[results["error"].isna()]
+    if results.empty:
+        return None
+    passing = results[
+        (results["ess_bulk_min"] >= min_ess)
+        & (results["divergences"] <= max_divergences)
+        & (results["r_hat_max"] <= max_r_hat)
+    ]
+    if passing.empty:
+        return None
+    return passing.loc[passing["runtime"].idxmin()]
@@ -0,0 +1,270 @@
+import os
+import numpy as np
+import arviz as az
+from multiprocessing import Pool
+
+from likelihood_utils import (
+    from_unconstrained,
+    log_prior,
+    log_likelihood_x,
+    log_likelihood_i,
+)
+
+
+def _log_prior_and_likelihood(u, x_observed, I_observed, a, b, c, d):
+    """
+    Log prior (including the transform Jacobian) and log likelihood in
+    unconstrained space, for an array of shape (..., dim).
+    """
+    params = from_unconstrained(u, a, b, c, d)
+    alpha, beta = params[..., 0], params[..., 1]
+
+    # Log Jacobian of the logistic transforms, written to avoid overflow
+    log_jacobian = np.log(b - a) + np.log(d - c)
+    for k in (0, 1):
+        log_jacobian = log_jacobian - np.logaddexp(0, u[..., k])
+        log_jacobian = log_jacobian - np.logaddexp(0, -u[..., k])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loglik = log_likelihood_x(alpha, beta, x_observed)
+        if u.shape[-1] == 3:
+            log_jacobian = log_jacobian + u[..., 2]
+            loglik = loglik + log_likelihood_i(
+                alpha, beta, params[..., 2], x_observed, I_observed
+            )
+        logprior = log_prior(params, a, b, c, d) + log_jacobian
+
+    logprior = np.where(np.isfinite(logprior), logprior, -np.inf)
+    loglik = np.where(np.isfinite(loglik), loglik, -np.inf)
+    return logprior, loglik
+
+
+def _initial_ladder(temperatures, beta_min=1e-3):
+    """
+    Inverse temperatures from 1 to `beta_min` geometrically, ending at 0.
+    """
+    return np.concatenate([np.geomspace(1, beta_min, temperatures - 1), [0.0]])
+
+
+def _tempering_worker(job):
+    """
+    Run the temperature ladder for a group of chains in one process.
+
+    Returns the beta = 1 samples in unconstrained space, the adapted ladder,
+    the summed log likelihood of every rung and the swap counts, so groups
+    run in different processes can be merged.
+    """
+    (
+        seed,
+        x_observed,
+        I_observed,
+        draws,
+        tune,
+        chains,
+        a,
+        b,
+        c,
+        d,
+        temperatures,
+        rwm_target_accept,
+    ) = job
+    rng = np.random.default_rng(seed)
+    dim = 2 if I_observed is None else 3
+
+    def evaluate(u):
+        return _log_prior_and_likelihood(u, x_observed, I_observed, a, b, c, d)
+
+    betas = _initial_ladder(temperatures)
+    log_gaps = np.log(-np.diff(betas))
+    log_scale = np.zeros(temperatures)
+    proposal_sd = np.ones((temperatures, dim))
+
+    q = rng.uniform(-1, 1, (temperatures, chains, dim))
+    logprior, loglik = evaluate(q)
+
+    samples = np.empty((chains, draws, dim))
+    sum_loglik = np.zeros(temperatures)
+    swaps_accepted = np.zeros(temperatures - 1)
+    swaps_proposed = np.zeros(temperatures - 1)
+    window = []
+
+    for i in range(tune + draws):
+        tuning = i < tune
+
+        # Random-walk Metropolis update of every replica at once
+        step = np.exp(log_scale)[:, None, None] * proposal_sd[:, None, :]
+        q_new = q + step * rng.standard_normal(q.shape)
+        logprior_new, loglik_new = evaluate(q_new)
+        with np.errstate(invalid="ignore"):
+            log_ratio = logprior_new - logprior
+            log_ratio += betas[:, None] * np.where(
+                np.isfinite(loglik_new), loglik_new - loglik, -np.inf
+            )
+        accept = np.log(rng.random(log_ratio.shape)) < log_ratio
+        q = np.where(accept[..., None], q_new, q)
+        logprior = np.where(accept, logprior_new, logprior)
+        loglik = np.where(accept, loglik_new, loglik)
+
+        # Swap neighbouring temperatures, alternating even and odd pairs
+        lower = np.arange(i % 2, temperatures - 1, 2)
+        upper = lower + 1
+        log_swap = (betas[lower] - betas[upper])[:, None] * (
+            loglik[upper] - loglik[lower]
+        )
+        swap = np.log(rng.random(log_swap.shape)) < log_swap
+        for values in (q, logprior, loglik):
+            lower_values = values[lower].copy()
+            values[lower] = np.where(_expand(swap, values), values[upper], lower_values)
+            values[upper] = np.where(_expand(swap, values), lower_values, values[upper])
+
+        if tuning:
+            # Adapt proposal scales and the ladder spacing
+            rate = 1 / (1 + i) ** 0.6
+            log_scale += rate * (accept.mean(axis=1) - rwm_target_accept)
+            swap_rates = np.full(temperatures - 1, np.nan)
+            swap_rates[lower] = swap.mean(axis=1)
+            observed = ~np.isnan(swap_rates)
+            log_gaps[observed] += rate * (
+                swap_rates[observed] - swap_rates[observed].mean()
+            )
+            gaps = np.exp(log_gaps) / np.exp(log_gaps).sum()
+            betas = np.concatenate([[1.0], 1 - np.cumsum(gaps)])
+            betas[-1] = 0.0
+
+            # Per-temperature proposal shape from the middle half of tuning
+            if tune // 4 <= i < 3 * tune // 4:
+                window.append(q)
+            if i == 3 * tune // 4 - 1 and len(window) > 1:
+                proposal_sd = np.std(np.array(window), axis=(0, 2)) + 1e-6
+                log_scale[:] = np.log(2.38 / np.sqrt(dim))
+        else:
+            k = i - tune
+            samples[:, k] = q[0]
+            sum_loglik += loglik.sum(axis=1)
+            swaps_accepted[lower] += swap.sum(axis=1)
+            swaps_proposed[lower] += chains
+
+    return samples, betas, sum_loglik, swaps_accepted, swaps_proposed
+
+
+def parallel_tempering(
+    x_observed,
+    I_observed,
+    seed,
+    draws,
+    tune,
+    chains,
+    a,
+    b,
+    c,
+    d,
+    temperatures=12,
+    rwm_target_accept=0.234,
+    processes=None,
+):
+    """
+    Sample the lighthouse posterior by replica exchange (parallel tempering).
+
+    A ladder of tempered posteriors, prior x likelihood^beta for inverse
+    temperatures beta from 1 down to 0, is run for every chain as a single
+    (temperatures, chains, dim) array. Each iteration performs a random-walk
+    Metropolis update of every replica followed by swaps between neighbouring
+    temperatures, alternating even and odd pairs. During tuning the proposal
+    scale of each temperature is adapted towards `rwm_target_accept` and the
+    spacing of the ladder is adapted to equalise the swap rates. The
+    thermodynamic integral of the mean log likelihood over beta gives an
+    estimate of the log evidence.
+
+    The chains are split into `processes` groups run on separate cores with
+    independent seeds. Each group adapts its own ladder, the draws and swap
+    counts are pooled, and the log evidence and the reported ladder are
+    averaged over the groups, weighted by their number of chains.
+
+    Parameters:
+    - x_observed : numpy.ndarray
+        Observed flash locations.
+    - I_observed : numpy.ndarray or None
+        Observed intensities. If None, the `define_model_x` posterior is
+        sampled, otherwise the `define_model_xi` posterior.
+    - seed : int
+        The random seed to use for reproducibility.
+    - draws, tune, chains : int
+        Sampling parameters as in `sample_model`.
+    - a, b, c, d : float
+        Prior bounds for alpha and beta.
+    - temperatures : int, optional
+        Number of rungs in the temperature ladder. Default is 12.
+    - rwm_target_accept : float, optional
+        Target acceptance rate of the random-walk Metropolis updates, distinct
+        from the NUTS `target_accept` of `read_config`. Default is 0.234.
+    - processes : int, optional
+        Number of worker processes. Defaults to the number of CPUs, at most
+        one per chain.
+
+    Returns:
+    - trace : arviz.InferenceData
+        Posterior draws from the beta = 1 replicas, with the ladder, swap
+        rates and log evidence in the posterior attributes.
+    """
+    x_observed = np.asarray(x_observed, dtype=np.float64)
+    if I_observed is not None:
+        I_observed = np.asarray(I_observed, dtype=np.float64)
+    dim = 2 if I_observed is None else 3
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, chains))
+    groups = [len(group) for group in np.array_split(np.arange(chains), processes)]
+    seeds = np.random.SeedSequence(seed).spawn(processes)
+    target = rwm_target_accept
+    jobs = [
+        (s, x_observed, I_observed, draws, tune, n, a, b, c, d, temperatures, target)
+        for s, n in zip(seeds, groups)
+    ]
+
+    if processes == 1:
+        results = [_tempering_worker(jobs[0])]
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_tempering_worker, jobs)
+
+    samples = np.concatenate([result[0] for result in results])
+    weights = np.array(groups) / chains
+    betas = np.zeros(temperatures)
+    log_evidence = 0.0
+    swaps_accepted = np.zeros(temperatures - 1)
+    swaps_proposed = np.zeros(temperatures - 1)
+    for weight, n, result in zip(weights, groups, results):
+        _, group_betas, sum_loglik, accepted, proposed = result
+        mean_loglik = sum_loglik / (max(draws, 1) * n)
+
+        # Thermodynamic integration over beta from 0 to 1 (betas are descending)
+        log_evidence += weight * np.sum(
+            0.5 * (mean_loglik[1:] + mean_loglik[:-1]) * -np.diff(group_betas)
+        )
+        betas += weight * group_betas
+        swaps_accepted += accepted
+        swaps_proposed += proposed
+
+    swap_rates = swaps_accepted / np.maximum(swaps_proposed, 1)
+
+    print("Inverse temperatures:", np.round(betas, 4))
+    print("Swap rates:", np.round(swap_rates, 2))
+    print(f"Thermodynamic log evidence: {log_evidence:.3f}")
+
+    params = from_unconstrained(samples, a, b, c, d)
+    var_names = ["alpha", "beta", "I0"][:dim]
+    posterior = {name: params[..., j] for j, name in enumerate(var_names)}
+    trace = az.from_dict(posterior=posterior)
+    trace.posterior.attrs["betas"] = betas
+    trace.posterior.attrs["swap_rates"] = swap_rates
+    trace.posterior.attrs["log_evidence"] = log_evidence
+
+    return trace
+
+
+def _expand(mask, values):
+    """
+    Broadcast a (pairs, chains) mask against values of shape (T, chains, ...).
+    """
+    return mask.reshape(mask.shape + (1,) * (values.ndim - 2))